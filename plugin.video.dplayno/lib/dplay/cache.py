@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Imports
+import time
+import logging
+import threading
+from hashlib import md5
+from urllib import urlencode
+
+
+# Logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('[Dplay.%s]' % (__name__))
+
+
+# Constants
+SWEEP_KEY       = 'response_sweep'
+SWEEP_INTERVAL  = 10 * 60 # Seconds between sweeps (earlier if over max_entries)
+MAX_ENTRIES     = 200
+MAX_BYTES       = 4 * 1024 * 1024 # Pickled size of entries (kept in Kodi memory)
+EVICT_RATIO     = 0.9 # Share of the bounds kept by eviction
+STALE_TTL       = 24 * 60 * 60 # Seconds expired entries are kept for revalidation
+
+
+# Class: ResponseCache
+class ResponseCache(object):
+    '''
+    Least recently used cache for API responses, kept in a storage of its
+    own with expiry and access times per entry (simpleplugin.MemStorage).
+    Entries are kept for revalidation until STALE_TTL after they expire. The
+    cache is swept every SWEEP_INTERVAL, or when entries added since the last
+    sweep take it over max_entries: expired entries are removed and the least
+    recently used entries are evicted while over max_entries or max_bytes.
+    '''
+
+    # Init
+    def __init__(self, storage, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.storage = storage
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+
+    # Key
+    @staticmethod
+    def key(url, params):
+        query = urlencode(sorted([
+            (k, v.encode('utf-8') if isinstance(v, unicode) else str(v)) for k, v in params.iteritems()
+        ]))
+        return 'response_%s' % (md5('%s?%s' % (url, query)).hexdigest())
+
+
+    # Get entry
+    def get(self, key):
+        with self.lock:
+            try:
+                entry = self.storage[key]
+            except KeyError:
+                return None
+
+            self.storage.touch(key)
+
+            return entry
+
+
+    # Set entry
+    def set(self, key, entry):
+        with self.lock:
+            self.storage.set(key, entry, expires=entry.get('expires', time.time()) + STALE_TTL)
+
+            # Sweep state (last sweep, entries after it and entries added since)
+            sweep = self.storage.get(SWEEP_KEY) or {'swept': 0, 'entries': 0, 'added': 0}
+            sweep['added'] += 1
+
+            if time.time() - sweep['swept'] > SWEEP_INTERVAL or sweep['entries'] + sweep['added'] > self.max_entries:
+                self.storage[SWEEP_KEY] = sweep # Counted as an entry
+                self._sweep(sweep)
+
+            self.storage[SWEEP_KEY] = sweep
+
+
+    # Remove expired entries and evict the least recently used
+    def _sweep(self, sweep):
+        expired = self.storage.purge_expired()
+        evicted = self.storage.evict(
+            int(self.max_entries * EVICT_RATIO) + 1, int(self.max_bytes * EVICT_RATIO)
+        )
+
+        sweep.update(swept=time.time(), entries=max(len(self.storage) - 1, 0), added=0)
+
+        logger.info('Removed %d expired and evicted %d cached response(s), %d left' % (
+            expired, evicted, sweep['entries']
+        ))
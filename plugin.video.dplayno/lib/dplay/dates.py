@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Imports
+import re
+import calendar
+from datetime import datetime, timedelta, tzinfo
+
+try:
+    import arrow
+except ImportError:
+    arrow = None
+
+
+# Constants
+TIMEZONE = 'Europe/Oslo'
+
+ISO_8601 = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d)(?::(\d\d)(?:\.\d+)?)?(Z|[+-]\d\d:?\d\d)?$'
+)
+
+
+# Class: Offset
+class Offset(tzinfo):
+    '''
+    Fixed UTC offset (in minutes).
+    '''
+
+    # Init
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.offset = timedelta(minutes=minutes)
+
+
+    # Pickle support
+    def __getinitargs__(self):
+        return (self.minutes,)
+
+
+    # Offset
+    def utcoffset(self, dt):
+        return self.offset
+
+
+    # Daylight saving (included in offset)
+    def dst(self, dt):
+        return timedelta(0)
+
+
+    # Name
+    def tzname(self, dt):
+        return '%s%02d:%02d' % ('-' if self.minutes < 0 else '+', abs(self.minutes) / 60, abs(self.minutes) % 60)
+
+
+    # Representation
+    def __repr__(self):
+        return '<Offset: %s>' % (self.tzname(None))
+
+
+# Offsets
+UTC = Offset(0)
+CET = Offset(60)
+CEST = Offset(120)
+
+# Daylight saving transitions (UTC) per year
+_transitions = {}
+
+
+# Last sunday of month (day)
+def _last_sunday(year, month):
+    last_day = calendar.monthrange(year, month)[1]
+    return last_day - (calendar.weekday(year, month, last_day) + 1) % 7
+
+
+# Daylight saving period for year (EU rules, starts and ends at 01:00 UTC)
+def _dst_period(year):
+    if year not in _transitions:
+        _transitions[year] = (
+            datetime(year, 3, _last_sunday(year, 3), 1),
+            datetime(year, 10, _last_sunday(year, 10), 1),
+        )
+    return _transitions[year]
+
+
+# Convert naive UTC datetime to Europe/Oslo
+def _to_oslo(utc):
+    start, end = _dst_period(utc.year)
+    offset = CEST if start <= utc < end else CET
+    return (utc + offset.offset).replace(tzinfo=offset)
+
+
+# Parse timestamp
+def parse(value, timezone=TIMEZONE):
+    '''
+    Parse an ISO-8601 timestamp (as returned by the API) to a timezone aware
+    datetime in the given timezone. Europe/Oslo is converted using a cached
+    table of daylight saving transitions, other timezones and formats fall
+    back to arrow (if available). Returns None for empty values.
+    '''
+    if not value:
+        return None
+
+    match = ISO_8601.match(value) if timezone == TIMEZONE else None
+
+    if not match:
+        if arrow is None:
+            return None
+        return arrow.get(value).to(timezone).datetime
+
+    year, month, day, hour, minute, second, offset = match.groups()
+
+    utc = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0))
+
+    if offset and offset != 'Z':
+        minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+        utc -= timedelta(minutes=minutes if offset[0] == '+' else -minutes)
+
+    return _to_oslo(utc)
+
+
+# Current time
+def now(timezone=TIMEZONE):
+    if timezone != TIMEZONE and arrow is not None:
+        return arrow.now(timezone).datetime
+    return _to_oslo(datetime.utcnow())
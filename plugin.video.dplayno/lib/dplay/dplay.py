@@ -3,10 +3,15 @@
 
 # Imports
 import json
+import time
 import logging
+import threading
 import requests
 
+import dates
+import workers
 import elements
+from cache import ResponseCache
 elements.TIMEZONE = 'Europe/Oslo'
 
 
@@ -19,6 +24,30 @@ URL_VIDEOS      = 'content/videos/'
 URL_PLAYBACK    = 'playback/videoPlaybackInfo/'
 URL_CHANNELS    = 'content/channels/'
 
+PAGE_WORKERS    = 4
+
+SHOWS_DEFAULTS = {
+    'page_size': 100,
+    'page_number': 1,
+    'include': ['genres', 'images']
+}
+
+VIDEOS_DEFAULTS = {
+    'page_size': 25,
+    'page_number': 1,
+    'include': ['images', 'genres', 'show']
+}
+
+AUTH_STORAGE_KEY = 'auth'
+AUTH_TTL        = 60 * 60 # Seconds, the token is requested as short lived
+
+CACHE_TTL = { # Seconds, endpoints not listed are never cached
+    URL_PLAYBACK:   2 * 60,
+    URL_VIDEOS:     5 * 60,
+    URL_SHOWS:      15 * 60,
+    URL_CHANNELS:   24 * 60 * 60,
+}
+
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -28,27 +57,103 @@ logger = logging.getLogger('[Dplay.%s]' % (__name__))
 # Class: Dplay
 class Dplay(object):
     # Init
-    def __init__(self):
+    def __init__(self, storage=None, cache=None):
         # Session
         self.session = requests.Session()
         self.session.headers['User-Agent'] = 'Android'
 
+        # Storage (dict-like, keeps token and user between plugin invocations)
+        self.storage = storage if storage is not None else {}
+
+        # Response cache (in a storage of its own, see ResponseCache)
+        self.cache = ResponseCache(cache) if cache is not None else None
+
+        # Authenticate
+        self.realm = None
+        self.token = None
+        self.user = None
+
+        self._authenticate()
+
+
+    # Authenticate
+    def _authenticate(self, refresh=False):
+        auth = None if refresh else self._load_auth()
+
+        if auth:
+            logger.info('Using cached token for realm %s' % (auth.get('realm')))
+
+            for cookie in auth.get('cookies', []):
+                self.session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+
+        else:
+            auth = self._obtain_auth()
+
+            if not auth:
+                return False
+
+            self.storage[AUTH_STORAGE_KEY] = auth
+
+        self.realm = auth.get('realm')
+        self.token = auth.get('token')
+        self.user = elements.User(auth.get('user'))
+
+        logger.info('Got user data: %s' % (self.user))
+
+        return True
+
+
+    # Load cached authentication
+    def _load_auth(self):
+        try:
+            auth = self.storage[AUTH_STORAGE_KEY]
+        except KeyError:
+            return None
+
+        if not auth or auth.get('expires', 0) < time.time():
+            logger.info('Cached token expired')
+            return None
+
+        return auth
+
+
+    # Obtain authentication (token and user)
+    def _obtain_auth(self):
+        self.session.cookies.clear()
+
         # Obtain token
         logger.info('Obtaining token')
-        
-        token_data = self._request_json(URL_BASE % (URL_TOKEN))
-        token_data = token_data[0].get('attributes', {})
-        
-        self.realm = token_data.get('realm')
-        self.token = token_data.get('token')
 
-        logger.info('Got token %s for realm %s' % (self.token, self.realm))
+        token_data, _ = self._request_json(URL_BASE % (URL_TOKEN), authenticate=False)
+
+        if not token_data:
+            logger.error('Could not obtain token')
+            return None
+
+        token_data = token_data.get('attributes', {})
+
+        logger.info('Got token %s for realm %s' % (token_data.get('token'), token_data.get('realm')))
 
         # User
-        user_data = self._request_json(URL_BASE % (URL_USER))
-        self.user = elements.User(user_data[0])
-        
-        logger.info('Got user data: %s' % (self.user))
+        user_data, _ = self._request_json(URL_BASE % (URL_USER), authenticate=False)
+
+        if not user_data:
+            logger.error('Could not obtain user data')
+            return None
+
+        return {
+            'realm': token_data.get('realm'),
+            'token': token_data.get('token'),
+            'user': user_data,
+            'cookies': [{
+                'name': c.name,
+                'value': c.value,
+                'domain': c.domain,
+                'path': c.path,
+                'secure': c.secure,
+            } for c in self.session.cookies],
+            'expires': time.time() + AUTH_TTL,
+        }
 
 
     # Prepare request parameters
@@ -78,14 +183,105 @@ class Dplay(object):
         return params
 
 
+    # Cache TTL for endpoint
+    def _cache_ttl(self, url):
+        for endpoint, ttl in CACHE_TTL.iteritems():
+            if url.startswith(URL_BASE % (endpoint)):
+                return ttl
+        return None
+
+
     # Request JSON data from API
-    def _request_json(self, url, default_params={}, **kwargs):
-        # Get JSON from data source
-        logger.info('Fetching data from %s' % (url))
-        
+    def _request_json(self, url, default_params={}, authenticate=True, **kwargs):
+        document = self._request_document(url, default_params, authenticate, **kwargs)
+
+        if document is None:
+            return None, None
+
+        return self._parse_document(document)
+
+
+    # Request all pages of JSON data from API
+    def _request_pages(self, url, default_params={}, **kwargs):
+        '''
+        Generator yielding (data, included) for the requested page and every
+        following page. The total number of pages is read from the response
+        meta of the first page, the remaining pages are fetched concurrently
+        and yielded in order. A page that could not be fetched is yielded as
+        (None, None).
+        '''
+        page_number = int(kwargs.get('page_number', default_params.get('page_number', 1)))
+        document = self._request_document(url, default_params, **kwargs)
+
+        if document is None:
+            logger.error('Could not fetch page %d of %s' % (page_number, url))
+            yield None, None
+            return
+
+        yield self._parse_document(document)
+
+        # Remaining pages
+        total_pages = int(document.get('meta', {}).get('totalPages', 1))
+
+        if total_pages > page_number:
+            logger.info('Fetching pages %d-%d' % (page_number + 1, total_pages))
+
+        for n, document in enumerate(workers.imap(
+            lambda n: self._request_document(url, default_params, **dict(kwargs, page_number=n)),
+            range(page_number + 1, total_pages + 1),
+            PAGE_WORKERS
+        ), page_number + 1):
+            if document is None:
+                logger.error('Could not fetch page %d of %s' % (n, url))
+                yield None, None
+
+            else:
+                yield self._parse_document(document)
+
+
+    # Request all pages of JSON data from API (merged)
+    def _request_all(self, url, default_params={}, **kwargs):
+        data = []
+        included = {}
+
+        for page_data, page_included in self._request_pages(url, default_params, **kwargs):
+            # Incomplete listing, fail as a single request does
+            if page_data is None:
+                return None, None
+
+            data.extend(page_data)
+            included.update(page_included)
+
+        return data, included
+
+
+    # Request JSON document from API
+    def _request_document(self, url, default_params={}, authenticate=True, **kwargs):
         # Prepare params
         params = self._prepare_params(default_params, **kwargs)
 
+        # Cached response
+        ttl = self._cache_ttl(url) if self.cache else None
+        cache_key = ResponseCache.key(url, params) if ttl else None
+
+        entry = self.cache.get(cache_key) if cache_key else None
+        headers = {}
+
+        if entry:
+            if entry.get('expires', 0) > time.time():
+                logger.info('Using cached response for %s' % (url))
+                return entry['data']
+
+            # Expired, revalidate instead of downloading again
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        # Get JSON from data source
+        logger.info('Fetching data from %s' % (url))
+
         # print '-'*50
         # print json.dumps(params, indent=4)
         # print '-'*50
@@ -97,10 +293,24 @@ class Dplay(object):
                 logger.info('  - %s=%s' % (param, value))
 
         # Request data
-        r = self.session.get(url, params=params)
+        r = self.session.get(url, params=params, headers=headers)
         
         logger.info('Requested %s (%d)' % (r.url, r.status_code))
 
+        # Not modified, serve cached response
+        if r.status_code == 304 and entry:
+            entry['expires'] = time.time() + ttl
+            self.cache.set(cache_key, entry)
+
+            return entry['data']
+
+        # Token expired or revoked, re-authenticate and retry once
+        if r.status_code == 401 and authenticate:
+            logger.warning('Unauthorized, refreshing token')
+
+            if self._authenticate(refresh=True):
+                return self._request_document(url, default_params, authenticate=False, **kwargs)
+
         try:
             r.raise_for_status()
 
@@ -111,15 +321,42 @@ class Dplay(object):
         except Exception as e:
             logger.error('Request failed, %s' % (str(e)))
 
-            return None, None
+            return None
+
+        else:
+            # Cache response
+            if cache_key:
+                self.cache.set(cache_key, {
+                    'data': data,
+                    'expires': time.time() + ttl,
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                })
+
+            return data
+
+
+    # Parse document into data and included elements indexed by (type, id)
+    def _parse_document(self, document):
+        return document['data'], elements.index_included(document.get('included'))
+
+
+    # Iterate pages of JSON data from API
+    def _iter_pages(self, url, default_params={}, all_pages=False, **kwargs):
+        if all_pages:
+            for data, included in self._request_pages(url, default_params, **kwargs):
+                if data is not None:
+                    yield data, included
 
         else:
-            # Return pre-parsed data
-            return data['data'], data.get('included', [])
+            data, included = self._request_json(url, default_params, **kwargs)
+
+            if data is not None:
+                yield data, included
 
 
     # Shows
-    def shows(self, **kwargs):
+    def shows(self, all_pages=False, **kwargs):
         '''
         Fetch video content from data source. Data is paginated. Accepts
         the following keyword arguments:
@@ -139,17 +376,31 @@ class Dplay(object):
                             primaryChannel.images
         sort[list]      Sort criteria
                             views.lastMonth
+        all_pages[bool] Fetch the requested page and all following pages
+                        (returns None if any page could not be fetched)
         '''
 
         # Request
-        data, included = self._request_json(URL_BASE % (URL_SHOWS), default_params={
-            'page_size': 100,
-            'page_number': 1,
-            'include': ['genres', 'images']
-        }, **kwargs)
+        request = self._request_all if all_pages else self._request_json
+        data, included = request(URL_BASE % (URL_SHOWS), default_params=SHOWS_DEFAULTS, **kwargs)
+
+        if data is None:
+            return None
             
         # Return show
         return [elements.Show(show, included=included, user=self.user) for show in data]
+
+
+    # Iterate shows
+    def iter_shows(self, all_pages=False, **kwargs):
+        '''
+        Generator version of shows, yields shows page by page as soon as
+        each page is fetched. Accepts the same keyword arguments.
+        '''
+
+        for data, included in self._iter_pages(URL_BASE % (URL_SHOWS), SHOWS_DEFAULTS, all_pages, **kwargs):
+            for show in data:
+                yield elements.Show(show, included=included, user=self.user)
       
     
     # Show
@@ -179,7 +430,7 @@ class Dplay(object):
 
 
     # Videos
-    def videos(self, **kwargs):
+    def videos(self, all_pages=False, **kwargs):
         '''
         Fetch video content from data source. Data is paginated. Accepts 
         
@@ -212,16 +463,34 @@ class Dplay(object):
                             views.lastMonth
                             earliestPlayableStart
                             videoType
+        all_pages[bool] Fetch the requested page and all following pages
+                        (returns None if any page could not be fetched)
         '''
 
         # Request
-        data, included = self._request_json(URL_BASE % (URL_VIDEOS), default_params={
-            'page_size': 25,
-            'page_number': 1,
-            'include': ['images', 'genres', 'show']
-        }, **kwargs)
+        request = self._request_all if all_pages else self._request_json
+        data, included = request(URL_BASE % (URL_VIDEOS), default_params=VIDEOS_DEFAULTS, **kwargs)
+
+        if data is None:
+            return None
+
+        now = dates.now(elements.TIMEZONE)
+
+        return [elements.Video(video, included=included, user=self.user, now=now) for video in data]
+
+
+    # Iterate videos
+    def iter_videos(self, all_pages=False, **kwargs):
+        '''
+        Generator version of videos, yields videos page by page as soon as
+        each page is fetched. Accepts the same keyword arguments.
+        '''
 
-        return [elements.Video(video, included=included, user=self.user) for video in data]
+        for data, included in self._iter_pages(URL_BASE % (URL_VIDEOS), VIDEOS_DEFAULTS, all_pages, **kwargs):
+            now = dates.now(elements.TIMEZONE)
+
+            for video in data:
+                yield elements.Video(video, included=included, user=self.user, now=now)
         
 
     # Playable
@@ -236,6 +505,37 @@ class Dplay(object):
         return elements.Playable(data) if data else None
 
 
+    # Playables
+    def playables(self, video_ids, **kwargs):
+        '''
+        Returns playback details for a list of videos, requested
+        concurrently. Results are in the given order (None for videos that
+        can not be played).
+        '''
+
+        return list(workers.imap(lambda video_id: self.playable(video_id, **kwargs), video_ids, PAGE_WORKERS))
+
+
+    # Prefetch playables
+    def prefetch_playables(self, video_ids):
+        '''
+        Requests playback details for a list of videos in a background
+        thread, so following playable calls are served from the response
+        cache. Returns the started thread (None if the cache is disabled).
+        '''
+
+        if not self.cache:
+            return None
+
+        logger.info('Prefetching playback details for %d video(s)' % (len(video_ids)))
+
+        thread = threading.Thread(target=self.playables, args=(list(video_ids),))
+        thread.setDaemon(True)
+        thread.start()
+
+        return thread
+
+
     # Channels
     def channels(self, **kwargs):
         '''
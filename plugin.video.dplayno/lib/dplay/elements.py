@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 
 # Imports
-import arrow
 import logging
 
+import dates
+
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -16,86 +17,111 @@ TIMEZONE = None
 
 
 
+# Index included elements by (type, id)
+def index_included(included):
+    return {(i.get('type'), i.get('id')): i for i in included or []}
+
+
 # Class: Element
 class Element(object):
+    # Only parsed fields are kept, the raw attributes are dropped after init.
+    # Relationships and included elements are referenced (not copied) until
+    # the element is pickled, which resolves the lazy relations first.
+    __slots__ = ('id', 'type', '_relationships', '_included')
+
+    # Lazily resolved relations (property names)
+    _lazy = ()
+
     # Init
-    def __init__(self, data, included=[]):
+    def __init__(self, data, included={}):
         # Element
         self.id = data.get('id')
         self.type = data.get('type')
 
-        self.attributes = data.get('attributes')
-        self.relationships = data.get('relationships')
-        self.included = included
+        self._relationships = data.get('relationships')
+        self._included = included if isinstance(included, dict) else index_included(included)
 
 
     # Get related
     def _get_related(self, relation):
-        if not self.relationships:
+        if not self._relationships:
             return []
 
         logger.info('Getting related %s for %s (%s)' % (relation, self.id, self.type))
 
         # Relationship
-        relationship = self.relationships.get(relation)
+        relationship = self._relationships.get(relation)
 
         # Check if relation exists
         if not relationship or 'data' not in relationship:
             logger.warning('Relationship not found')
             return []
 
-        # Determine if single relation
-        is_single_relation = False if type(relationship.get('data')) == list else True
+        # Single relation
+        related = relationship.get('data')
 
-        # Find relation ID(s)
-        related_ids = []
-        
-        if is_single_relation:
-            related_ids = [relationship.get('data', {}).get('id')]
-        else:
-            related_ids = [r.get('id') for r in relationship.get('data', [])]
+        if type(related) != list:
+            return self._included.get((related.get('type'), related.get('id')), [])
 
-        # Return related element(s)
-        related_type = relation if is_single_relation else relation[0:-1] # Sketchy...
-        related_elements = []
+        # Return related elements
+        related_keys = [(r.get('type'), r.get('id')) for r in related]
+
+        return [self._included[k] for k in related_keys if k in self._included]
 
-        logger.info('Finding %d related element(s) of type "%s"' % (len(related_ids), related_type))
-        
-        for element in self.included:
-            if element.get('type') == related_type and element.get('id') in related_ids:
-                related_elements.append(element)
 
-        return related_elements[0] if is_single_relation and len(related_elements) > 0 else related_elements
+    # Public slots of element class
+    @classmethod
+    def _fields(cls):
+        return [f for c in reversed(cls.__mro__) for f in c.__dict__.get('__slots__', ()) if not f.startswith('_')]
 
 
     # Dictionary representation
     def dict(self):
-        d = self.__dict__
-        del d['attributes']
-        del d['relationships']
-        del d['included']
+        d = {f: getattr(self, f) for f in self._fields() if hasattr(self, f)}
+        d.update({r: getattr(self, r) for r in self._lazy})
         return d
 
 
+    # Pickle state (related elements are resolved, raw data dropped)
+    def __getstate__(self):
+        return self.dict()
+
+
+    # Restore pickled state
+    def __setstate__(self, state):
+        self._relationships = None
+        self._included = {}
+
+        for r in self._lazy:
+            setattr(self, '_%s' % (r), state.pop(r, None))
+
+        for field, value in state.iteritems():
+            setattr(self, field, value)
+
+
     # Representation
     def __repr__(self):
         return '<%s: id=%s, name=%s>' % (
-            self.type.capitalize(), self.id, repr(self.__dict__.get('name'))
+            self.type.capitalize(), self.id, repr(getattr(self, 'name', None))
         )
 
 
 # Class: User
 class User(Element):
+    __slots__ = ('profile_id', 'realm', 'packages', 'is_anonymous')
+
     # Init
-    def __init__(self, data, included=[]):
+    def __init__(self, data, included={}):
         # Super
         super(User, self).__init__(data, included)
 
         # Attributes
-        self.profile_id = self.attributes.get('selectedProfileId')
-        self.realm = self.attributes.get('realm')
-        self.packages = [p.lower() for p in self.attributes.get('packages')]
-        self.is_anonymous = self.attributes.get('anonymous')
+        attributes = data.get('attributes') or {}
+
+        self.profile_id = attributes.get('selectedProfileId')
+        self.realm = attributes.get('realm')
+        self.packages = [p.lower() for p in attributes.get('packages')]
+        self.is_anonymous = attributes.get('anonymous')
 
 
     # Representation
@@ -107,27 +133,31 @@ class User(Element):
 
 # Class: Genre
 class Genre(Element):
+    __slots__ = ('name',)
+
     # Init
-    def __init__(self, data, included=[]):
+    def __init__(self, data, included={}):
         # Super
         super(Genre, self).__init__(data, included)
 
         # Attributes
-        self.name = self.attributes.get('name')
+        self.name = (data.get('attributes') or {}).get('name')
 
 
 # Class: Image
 class Image(Element):
+    __slots__ = ('kind', 'src')
+
     # Init
-    def __init__(self, data, included=[]):
+    def __init__(self, data, included={}):
         # Super
         super(Image, self).__init__(data, included)
 
         # Attributes
-        self.kind = self.attributes.get('kind')
-        self.src = self.attributes.get('src')
-        self.width = self.attributes.get('width')
-        self.height = self.attributes.get('height')
+        attributes = data.get('attributes') or {}
+
+        self.kind = attributes.get('kind')
+        self.src = attributes.get('src')
 
 
     # Representation
@@ -139,34 +169,58 @@ class Image(Element):
 
 # Class: Season
 class Season(Element):
+    __slots__ = ('season_number', 'video_count')
+
     # Init
-    def __init__(self, data, included=[]):
+    def __init__(self, data, included={}):
         # Super
         super(Season, self).__init__(data, included)
 
         # Attributes
-        self.season_number = self.attributes.get('seasonNumber')
-        self.episode_count = self.attributes.get('episodeCount')
-        self.video_count = self.attributes.get('videoCount')
+        attributes = data.get('attributes') or {}
+
+        self.season_number = attributes.get('seasonNumber')
+        self.video_count = attributes.get('videoCount')
 
 
 # Class: Program
 class Program(Element):
+    __slots__ = ('name', 'description', 'packages', 'authorized', '_images', '_genres')
+
+    _lazy = ('images', 'genres')
+
     # Init
-    def __init__(self, data, included=[], user=None):
+    def __init__(self, data, included={}, user=None):
         # Super
         super(Program, self).__init__(data, included)
 
         # Attributes
-        self.name = self.attributes.get('name').encode('utf-8')
-        self.alternate_id = self.attributes.get('alternateId')
-        self.description = self.attributes.get('description')
-        self.packages = [p.get('id').lower() for p in self.relationships.get('contentPackages', {}).get('data', [])]
+        attributes = data.get('attributes') or {}
+
+        self.name = attributes.get('name').encode('utf-8')
+        self.description = attributes.get('description')
+        self.packages = [p.get('id').lower() for p in (self._relationships or {}).get('contentPackages', {}).get('data', [])]
         self.authorized = user != None and len(set(user.packages).intersection(self.packages)) > 0
         
-        # Related
-        self.images = [Image(i) for i in self._get_related('images')]
-        self.genres = [Genre(g) for g in self._get_related('genres')]
+        # Related (resolved on first access)
+        self._images = None
+        self._genres = None
+
+
+    # Images
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = [Image(i) for i in self._get_related('images')]
+        return self._images
+
+
+    # Genres
+    @property
+    def genres(self):
+        if self._genres is None:
+            self._genres = [Genre(g) for g in self._get_related('genres')]
+        return self._genres
 
 
     # Get image source by kind
@@ -179,45 +233,62 @@ class Program(Element):
 
 # Class: Show
 class Show(Program):
+    __slots__ = ('video_count', 'newest_episode_publish_start', '_seasons')
+
+    _lazy = Program._lazy + ('seasons',)
+
     # Init
-    def __init__(self, data, included=[], user=None):
+    def __init__(self, data, included={}, user=None):
         # Super
         super(Show, self).__init__(data, included, user)
 
         # Attributes
-        self.season_numbers = self.attributes.get('seasonNumbers', [])
-        self.season_count = len(self.season_numbers)
-        self.episode_count = self.attributes.get('episodeCount')
-        self.video_count = self.attributes.get('videoCount')
-        self.newest_episode_publish_start = arrow.get(self.attributes.get('newestEpisodePublishStart')).to(TIMEZONE)
+        attributes = data.get('attributes') or {}
+
+        self.video_count = attributes.get('videoCount')
+        self.newest_episode_publish_start = dates.parse(attributes.get('newestEpisodePublishStart'), TIMEZONE)
+
+        # Related (resolved on first access)
+        self._seasons = None
+
 
-        # Related
-        self.seasons = [Season(s) for s in self._get_related('seasons')]
+    # Seasons
+    @property
+    def seasons(self):
+        if self._seasons is None:
+            self._seasons = [Season(s) for s in self._get_related('seasons')]
+        return self._seasons
 
 
 # Class: Video
 class Video(Program):
+    __slots__ = ('season_number', 'episode_number', 'aired', 'duration', 'duration_ms', '_show')
+
+    _lazy = Program._lazy + ('show',)
+
     # Init
-    def __init__(self, data, included=[], user=None):
+    def __init__(self, data, included={}, user=None, now=None):
         # Super
         super(Video, self).__init__(data, included, user)
         
         # Attributes
-        self.season_number = self.attributes.get('seasonNumber')
-        self.episode_number = self.attributes.get('episodeNumber')
-        self.aired = arrow.get(self.attributes.get('airDate')).to(TIMEZONE)
-        self.duration = (int(self.attributes.get('videoDuration', 0)) / 1000) # In seconds
-        self.duration_ms = self.attributes.get('videoDuration', 0)
+        attributes = data.get('attributes') or {}
+
+        self.season_number = attributes.get('seasonNumber')
+        self.episode_number = attributes.get('episodeNumber')
+        self.aired = dates.parse(attributes.get('airDate'), TIMEZONE)
+        self.duration = (int(attributes.get('videoDuration', 0)) / 1000) # In seconds
+        self.duration_ms = attributes.get('videoDuration', 0)
 
-        self.availability = {}
+        availability = {}
+        current_time = now or dates.now(TIMEZONE)
 
-        for available in self.attributes.get('availabilityWindows', []):
+        for available in attributes.get('availabilityWindows', []):
             package = available.get('package').lower()
-            start = arrow.get(available.get('playableStart')).to(TIMEZONE) if available.get('playableStart') else None
-            end = arrow.get(available.get('playableEnd')).to(TIMEZONE) if available.get('playableEnd') else None
-            current_time = arrow.now(TIMEZONE)
-            available_now = (current_time > start and not end) or (current_time > start and current_time < end)
-            self.availability[package] = {
+            start = dates.parse(available.get('playableStart'), TIMEZONE)
+            end = dates.parse(available.get('playableEnd'), TIMEZONE)
+            available_now = (not start or current_time > start) and (not end or current_time < end)
+            availability[package] = {
                 'start': start,
                 'end': end,
                 'now': available_now,
@@ -226,29 +297,41 @@ class Video(Program):
         # Description
         self.description += '\n\n'
         self.description += 'Aired: %s\n' % (
-            self.aired.format('DD.MM.YYYY, HH:mm') if self.aired else '',
+            self.aired.strftime('%d.%m.%Y, %H:%M') if self.aired else '',
         )
 
-        for package, availability in self.availability.items():
-            start = availability['start']
-            end = availability['end']
+        for package, window in availability.items():
+            start = window['start']
+            end = window['end']
             self.description += '%s: %s - %s\n' % (
                 package.capitalize(), 
-                start.format('DD.MM.YYYY, HH:mm') if start else '',
-                end.format('DD.MM.YYYY, HH:mm') if end else ''
+                start.strftime('%d.%m.%Y, %H:%M') if start else '',
+                end.strftime('%d.%m.%Y, %H:%M') if end else ''
             )
         
         # Authorization
         self.authorized = False
 
         for package in user.packages:
-            if self.availability.get(package, {}).get('now', False):
+            if availability.get(package, {}).get('now', False):
                 self.authorized = True
 
-        # Related
-        self.show = Show(self._get_related('show'))
+        # Related (resolved on first access)
+        self._show = None
+
+
+    # Show
+    @property
+    def show(self):
+        if self._show is None:
+            self._show = Show(self._get_related('show'))
+        return self._show
+
 
-        self.full_name = '%s (%s.%s): %s' % (
+    # Full name
+    @property
+    def full_name(self):
+        return '%s (%s.%s): %s' % (
             self.show.name,
             str(self.season_number),#.zfill(2),
             str(self.episode_number),#.zfill(2),
@@ -256,7 +339,6 @@ class Video(Program):
         )
 
 
-
     # Representation
     def __repr__(self):
         return '<%s: id=%s, name=%s, aired=%s>' % (
@@ -266,23 +348,24 @@ class Video(Program):
 
 # Class: Playable
 class Playable(Element):
+    __slots__ = ('streams',)
+
     # Init
-    def __init__(self, data, included=[]):
+    def __init__(self, data, included={}):
         # Super
         super(Playable, self).__init__(data, included)
 
         # Attributes
         self.streams = {
-            p: s.get('url') for p, s in self.attributes.get('streaming', {}).iteritems()
+            p: s.get('url') for p, s in (data.get('attributes') or {}).get('streaming', {}).iteritems()
         }
 
 
 # Class: Channel
 class Channel(Program):
+    __slots__ = ()
+
     # Init
-    def __init__(self, data, included=[], user=None):
+    def __init__(self, data, included={}, user=None):
         # Super
-        super(Channel, self).__init__(data, included, user)
-
-        # Attributes
-        self.has_live_stream = self.attributes.get('hasLiveStream')
\ No newline at end of file
+        super(Channel, self).__init__(data, included, user)
\ No newline at end of file
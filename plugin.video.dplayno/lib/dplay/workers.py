@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Imports
+import sys
+import Queue
+import threading
+
+
+# Map function over items concurrently
+def imap(func, items, workers=4, window=None):
+    '''
+    Call func for every item using a bounded number of daemon threads and
+    yield the results in item order as soon as they are available. An
+    exception raised by func is re-raised when its result is reached.
+    Closing the generator early stops the workers from taking new items.
+
+    window limits how many items may be started ahead of the item being
+    yielded, which bounds the number of results held in memory.
+    '''
+    items = list(items)
+
+    if not items:
+        return
+
+    pending = Queue.Queue()
+    results = {}
+    condition = threading.Condition()
+    stopped = threading.Event()
+    ahead = threading.Semaphore(window) if window else None
+
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    # Worker
+    def worker():
+        while not stopped.is_set():
+            if ahead:
+                ahead.acquire()
+
+                if stopped.is_set():
+                    return
+
+            try:
+                index, item = pending.get_nowait()
+            except Queue.Empty:
+                if ahead:
+                    ahead.release()
+                return
+
+            try:
+                result = (True, func(item))
+            except Exception:
+                result = (False, sys.exc_info())
+
+            with condition:
+                results[index] = result
+                condition.notify_all()
+
+    for _ in range(min(workers, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+
+    try:
+        for index in range(len(items)):
+            with condition:
+                while index not in results:
+                    condition.wait()
+
+                succeeded, result = results.pop(index)
+
+            if ahead:
+                ahead.release()
+
+            if not succeeded:
+                raise result[0], result[1], result[2]
+
+            yield result
+
+    finally:
+        stopped.set()
+
+        # Wake up workers waiting for the window
+        if ahead:
+            for _ in range(workers):
+                ahead.release()
@@ -1,24 +1,120 @@
 # Imports
 import os
 import re
-import sys
 import time
 import logging
-import pexpect
-import pexpect.popen_spawn
+import threading
 from urllib import unquote
 from distutils.spawn import find_executable
 
+import hls
+import ffmpy
+
 
 # Logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger('[Dplay.%s]' % (__name__))
 
 
+# Constants
+PROGRESS_INTERVAL   = 1.0 # Minimum seconds between progress callbacks
+FFMPEG_OPTIONS      = ['-y', '-nostats', '-loglevel', 'error', '-progress', 'pipe:2']
+PROGRESS_LINE       = re.compile(r'^[\w.]+=\S*$') # Not logged as ffmpeg errors
+SPACE_MARGIN        = 1.1 # Estimated size is increased by this factor before checking free space
+
+
+# Class: DownloadCancelled
+class DownloadCancelled(Exception):
+    pass
+
+
+# Class: InsufficientSpace
+class InsufficientSpace(Exception):
+    pass
+
+
+# Class: FileExists
+class FileExists(Exception):
+    pass
+
+
+# Free disk space (bytes) of path, None if unknown
+def free_space(path):
+    try:
+        if hasattr(os, 'statvfs'):
+            stat = os.statvfs(path)
+            return stat.f_bavail * stat.f_frsize
+
+        import ctypes
+
+        free = ctypes.c_ulonglong(0)
+        ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(path), None, None, ctypes.pointer(free))
+
+        return free.value
+
+    except Exception as e:
+        logger.warning('Unable to get free space of %s, %s' % (path, str(e)))
+
+        return None
+
+
+# Journal path of video download (see hls.Journal)
+def journal_path(output_path, video_id):
+    return os.path.join(output_path, '.dplay_%d.journal' % (int(video_id)))
+
+
+# Remove partial download of video (kept when a download is interrupted, so it can be resumed)
+def remove_partial(output_path, video_id):
+    journal = hls.Journal(journal_path(output_path, video_id))
+    temporary = journal.get('temporary')
+
+    if temporary and os.path.exists(temporary):
+        logger.info('Removing %s' % (temporary))
+        os.remove(temporary)
+
+    journal.remove()
+
+
+# Class: ProgressReporter
+class ProgressReporter(object):
+    '''
+    ffmpeg progress handler (see ffmpy.FFstate). Calls the callback with the
+    percentage of the duration written, at most once per interval and only
+    when it changed, and always when ffmpeg reports the end.
+    '''
+
+    # Init
+    def __init__(self, callback, interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.progress = None
+        self.reported = 0
+        self.state = None
+
+
+    # Progress
+    def __call__(self, state):
+        self.state = state
+
+        if state.percent is None:
+            return
+
+        now = time.time()
+
+        if state.done or (state.percent != self.progress and now - self.reported >= self.interval):
+            logger.debug('Progress %d %% (%s bytes, speed %sx, ETA %s s)' % (
+                state.percent, state.size, state.speed, int(state.eta) if state.eta is not None else '?'
+            ))
+
+            self.progress = state.percent
+            self.reported = now
+            self.callback(state.percent)
+
+
 # Class: DplayDownloadTask
 class DplayDownloadTask(object):
     # Init
-    def __init__(self, stream_url, video_id, video_full_name, duration, output_path):
+    def __init__(self, stream_url, video_id, video_full_name, duration, output_path, native=True, rate_limiter=None, cancel_callback=None, variant_limits=None):
         logger.info('Initializing new download task')
 
         # Properties
@@ -27,20 +123,30 @@ class DplayDownloadTask(object):
         self.video_full_name = video_full_name
         self.duration = int(duration)
         self.output_path = output_path
+        self.native = native
+        self.rate_limiter = rate_limiter
+        self.cancel_callback = cancel_callback
+        self.variant_limits = variant_limits or {}
         
         logger.debug('Stream URL: %s' % (self.stream_url))
         logger.debug('Video ID: %d' % (self.video_id))
         logger.debug('Full name: %s' % (self.video_full_name))
         logger.debug('Duration: %d' % (self.duration))
         logger.debug('Output path: %s' % (self.output_path))
+        logger.debug('Built-in HLS downloader: %s' % (self.native))
+        logger.debug('Variant limits: %s' % (self.variant_limits))
         
         # Task
-        self.command = None
+        self.ffmpeg = find_executable('ffmpeg')
         self.destination = None
         self.process = None
+        self.temporary = [] # Removed when cancelled (partial segment downloads are kept to be resumed)
+        self.throughput = None # Bytes per second
+        self.estimated_size = None # Bytes
+        self._cancelled = threading.Event()
         self._prepare_task()
 
-        logger.debug('Command: %s' % (self.command))
+        logger.debug('ffmpeg: %s' % (self.ffmpeg))
         logger.debug('Destination: %s' % (self.destination))
 
 
@@ -52,15 +158,92 @@ class DplayDownloadTask(object):
 
         progress_callback = progress_callback or self._progress_callback
 
-        # Execute
-        return self._execute(progress_callback)
+        if os.path.exists(self.destination):
+            logger.error('File already exists')
+            raise FileExists('file already exists')
+
+        # Execute (built-in HLS downloader, ffmpeg if not supported)
+        try:
+            if self.native:
+                try:
+                    return self._execute_native(progress_callback)
+
+                except hls.HLSUnsupportedError as e:
+                    logger.warning('Built-in HLS download not possible (%s), using ffmpeg' % (str(e)))
+
+            return self._execute(progress_callback)
+
+        except (DownloadCancelled, hls.HLSCancelledError, ffmpy.FFCancelledError):
+            logger.warning('Download of video id %d cancelled' % (self.video_id))
+            self._cleanup()
+            raise DownloadCancelled('download cancelled')
+
+
+    # Cancelled
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or bool(self.cancel_callback and self.cancel_callback())
 
     
-    # Abort
+    # Abort (may be called from another thread, ffmpeg is stopped within a second)
     def abort(self):
         logger.warning('Cancelling download task')
-        # print '-'*500
-        # self.process.kill(pexpect.signal.SIGINT)
+
+        self._cancelled.set()
+
+
+    # Pre-flight (estimate output size and check free space)
+    def _preflight(self, bandwidth, source, factor=1, existing=0):
+        # Bit rate from playlist, probed if not available
+        bandwidth = bandwidth or self._probe_bitrate(source)
+
+        if not bandwidth:
+            logger.warning('Unable to estimate size, not checking free space')
+            return
+
+        self.estimated_size = int(bandwidth / 8.0 * self.duration / 1000)
+
+        required = self.estimated_size * SPACE_MARGIN * factor - existing
+        free = free_space(self.output_path)
+
+        logger.info('Estimated size %d MB (%d MB free)' % (
+            self.estimated_size / 1048576, free / 1048576 if free is not None else -1
+        ))
+
+        if free is not None and required > free:
+            raise InsufficientSpace('not enough disk space (%d MB needed, %d MB free)' % (
+                required / 1048576, free / 1048576
+            ))
+
+
+    # Probe bit rate (bits per second) of source with ffprobe
+    def _probe_bitrate(self, source):
+        ffprobe = find_executable('ffprobe')
+
+        if not ffprobe:
+            return None
+
+        try:
+            out, _ = ffmpy.FFprobe(
+                executable=ffprobe,
+                global_options=['-v', 'error', '-show_entries', 'format=bit_rate', '-of', 'default=nw=1:nk=1'],
+                inputs={source: None},
+            ).run()
+
+            return int(out.strip())
+
+        except (ffmpy.FFRuntimeError, ValueError) as e:
+            logger.warning('Probing %s failed, %s' % (source, str(e)))
+
+            return None
+
+
+    # Remove temporary files
+    def _cleanup(self):
+        for path in self.temporary:
+            if os.path.exists(path):
+                logger.info('Removing %s' % (path))
+                os.remove(path)
 
 
     # Prepare
@@ -73,7 +256,7 @@ class DplayDownloadTask(object):
             self.video_id is not None,
             self.duration is not None,
             self.duration > 0,
-            find_executable('ffmpeg') is not None,
+            self.native or self.ffmpeg is not None,
             os.path.exists(self.output_path),
         ]
 
@@ -87,140 +270,150 @@ class DplayDownloadTask(object):
         output_file = ''.join([c for c in self.video_full_name if c.isalpha() or c.isdigit() or c==' ']).rstrip()
         output_file = output_file.replace(' ', '_').replace('__', '_').lower()
         self.destination = os.path.join(self.output_path, output_file + '.mp4')
-        
-        # Command
-        self.command = 'ffmpeg.exe -i %s -c copy -bsf:a aac_adtstoasc %s' % (
-            self.stream_url, self.destination
+
+
+    # Run ffmpeg (copy streams into mp4), raises ffmpy.FFRuntimeError on failure
+    def _run_ffmpeg(self, source, destination, options=[], progress_callback=None):
+        self.process = ffmpy.FFmpeg(
+            executable=self.ffmpeg,
+            global_options=FFMPEG_OPTIONS,
+            inputs={source: None},
+            outputs={destination: ['-c', 'copy', '-bsf:a', 'aac_adtstoasc'] + options},
         )
 
-    
-    # Execute
-    def _execute(self, progress_callback):
-        logger.info('Spawning ffmpeg process, cmd=%s' % (self.command))
+        logger.info('Running ffmpeg, cmd=%s' % (self.process.cmd))
+
+        with open(os.devnull, 'wb') as devnull:
+            self.process.run(
+                stdout=devnull,
+                on_progress=ProgressReporter(progress_callback) if progress_callback else None,
+                should_stop=lambda: self.cancelled,
+                duration=self.duration / 1000.0,
+            )
+
+
+    # Execute with built-in HLS downloader
+    def _execute_native(self, progress_callback):
+        logger.info('Downloading segments with built-in HLS downloader')
 
-        self.process = pexpect.popen_spawn.PopenSpawn(self.command)
+        # Journal (kept if the download fails or is cancelled, so a retry resumes,
+        # see remove_partial)
+        journal = hls.Journal(journal_path(self.output_path, self.video_id))
+
+        downloader = hls.HLSDownloader(
+            self.stream_url, rate_limiter=self.rate_limiter, variant_limits=self.variant_limits
+        )
+        downloader.prepare(bandwidth=journal.get('bandwidth'))
 
         progress_callback(0)
 
-        while True:
-            expectations = ['\n', 'already exists']
-            
-            try:
-                expected = self.process.expect(expectations)
-
-                if expected == 0:
-                    progress = self._frame_received(self.process.before)
-                    
-                    if progress >= 0 and progress <= 100:
-                        progress_callback(progress)
-                
-                elif expected == 1:
-                    logger.error('File already exists')
-                    raise Exception('file already exists')
-                
-            except pexpect.EOF:
-                logger.info('ffmpeg process ended')
-                break
-
-            # except Exception as e:
-            #     logger.error('ffmpeg process failed, %s' % (str(e)))
-            #     raise Exception('ffmpeg failed')
+        # Download segments into temporary file
+        base = os.path.splitext(self.destination)[0]
+        temporary = base + downloader.extension + '.part'
 
-        return True
+        # Transport stream is remuxed into a copy, a resumed download has some already
+        self._preflight(
+            downloader.variant.bandwidth if downloader.variant else None,
+            self.stream_url,
+            factor=2 if downloader.extension == '.ts' and self.ffmpeg else 1,
+            existing=os.path.getsize(temporary) if os.path.exists(temporary) else 0,
+        )
 
+        downloader.download(temporary, progress_callback, journal, lambda: self.cancelled)
 
-    # Frame received
-    def _frame_received(self, line):
-        # Parse frame
-        raw_update = {}
-        
-        for match in re.finditer(r'(?P<key>\S+)=\s*(?P<value>\S+)', line.decode()):
-            raw_update[match.group('key')] = match.group('value')
+        self.throughput = downloader.throughput
 
-        if not raw_update or not raw_update.get('time'):
-            return
-        
-        time = self._parse_timecode(raw_update.get('time'))
+        # Fragmented MP4, done
+        if downloader.extension == '.mp4':
+            os.rename(temporary, self.destination)
+            journal.remove()
+            return True
 
-        if not time:
-            return
+        # Transport stream, remux into mp4 if ffmpeg is available
+        if not self.ffmpeg:
+            logger.warning('ffmpeg not found, keeping transport stream')
+            self.destination = base + '.ts'
+            os.rename(temporary, self.destination)
+            journal.remove()
+            return True
 
-        # Determine progress
-        progress = int(((time / self.duration) * 100))
+        # Journal is kept until remuxed, a cancelled remux leaves the segments to be
+        # resumed (or removed by remove_partial)
+        logger.info('Remuxing %s into %s' % (temporary, self.destination))
 
-        logger.info('%s = %s %%' % (
-            ', '.join(['%s=%s' % (k, v) for k, v in raw_update.iteritems()]),
-            str(progress)
-        ))
+        self.temporary.append(self.destination)
 
-        return progress
+        try:
+            self._run_ffmpeg(temporary, self.destination)
 
-    
-    # Parse timecode
-    def _parse_timecode(self, time_code):
-        time_units_match = re.match(
-            r"(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+.\d+)", time_code)
-        if time_units_match is not None:
-            return ((int(time_units_match.group("hours")) * 3600 + int(
-                time_units_match.group("minutes")) * 60 + float(time_units_match.group("seconds"))) * 1000)
-        return None
+        except ffmpy.FFRuntimeError as e:
+            logger.error('Remux failed (%d), keeping transport stream' % (e.exit_code))
 
-    
-    # Progress callback
-    def _progress_callback(self, progress):
-        pass
+            if os.path.exists(self.destination):
+                os.remove(self.destination)
 
+            self.destination = base + '.ts'
+            os.rename(temporary, self.destination)
+            journal.remove()
+            return True
 
-# Main
-if __name__ == '__main__':
-    # stream_url = 'http://multiplatform-f.akamaihd.net/i/multi/will/bunny/big_buck_bunny_,640x360_400,640x360_700,640x360_1000,950x540_1500,.f4v.csmil/master.m3u8'
-    # duration = 596490
+        os.remove(temporary)
+        journal.remove()
 
-    '''
-    1: stream url (quoted)
-    2: video id
-    3: video full name
-    4: video duration (ms)
-    5: download path
-    '''
+        return True
 
-    # Dialogs
-    import xbmcgui
     
-    ndlg = xbmcgui.Dialog()
-    # pdlg = xbmcgui.DialogProgress()
-    pdlg = xbmcgui.DialogProgressBG()
+    # Execute with ffmpeg
+    def _execute(self, progress_callback):
+        if not self.ffmpeg:
+            logger.error('ffmpeg not found')
+            raise Exception('ffmpeg not found')
 
-    # Task
-    try:
-        task = DplayDownloadTask(*sys.argv[1:6])
+        # Written to temporary file, renamed when done
+        temporary = self.destination + '.part'
+        self.temporary.append(temporary)
 
-        # Progress callback
-        # pdlg.create('Dplay Download', 'Video: %s' % (task.video_full_name), 'Starting...')
-        pdlg.create('Dplay', 'Downloading "%s"' % (task.video_full_name))
+        # Single variant (ffmpeg would otherwise read all of them)
+        try:
+            variants = hls.fetch_variants(self.stream_url)
+            variant = hls.select_variant(variants, **self.variant_limits)
 
-        def callback(progress):
-            # if pdlg.iscanceled():
-            #     task.abort()
-            #     pdlg.close()
+        except Exception as e:
+            logger.warning('Variant selection failed (%s), using master playlist' % (str(e)))
+            variant = None
 
-            # pdlg.update(*[
-            #     progress, 
-            #     'Video: %s' % (task.video_full_name),
-            #     'Progress: %d %%' % (progress),
-            # ])
-            pdlg.update(percent=progress)
+        source = variant.url if variant else self.stream_url
+        options = ['-f', 'mp4']
 
-        # Start
-        done = task.start(progress_callback=callback)
+        # Audio in own playlists, read master playlist and map the variant
+        # program (video and audio) instead
+        if variant and variant.alternates:
+            program = variants.index(variant)
+            source = self.stream_url
+            options = ['-map', '0:p:%d:v' % (program), '-map', '0:p:%d:a?' % (program)] + options
 
-    except Exception as e:
-        pdlg.close()
-        logger.error('Download failed, error=%s' % (str(e)))
-        ndlg.notification('Dplay', 'Download failed (%s)' % (str(e)))
-
-    else:
-        pdlg.close()
-        ndlg.notification('Dplay', '%s' % (
-            'Done downloading' if done else 'Download failed'
-        ))
\ No newline at end of file
+        self._preflight(variant.bandwidth if variant else None, source)
+
+        progress_callback(0)
+
+        started = time.time()
+
+        try:
+            self._run_ffmpeg(source, temporary, options, progress_callback)
+
+        except ffmpy.FFRuntimeError as e:
+            logger.error('ffmpeg exited with status %d, %s' % (e.exit_code, ' '.join(
+                [l for l in e.stderr.splitlines() if l and not PROGRESS_LINE.match(l)]
+            )))
+            return False
+
+        self.throughput = os.path.getsize(temporary) / max(time.time() - started, 0.001)
+
+        os.rename(temporary, self.destination)
+
+        return True
+
+
+    # Progress callback
+    def _progress_callback(self, progress):
+        pass
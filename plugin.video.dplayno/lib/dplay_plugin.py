@@ -1,10 +1,19 @@
 # Imports
-from urllib import quote, unquote
+import json
+from urllib import unquote
 from urlparse import parse_qs
 from ast import literal_eval
 from simpleplugin import Plugin, Params
 
 
+# Constants
+THROUGHPUT_KEY      = 'throughput'  # Last measured download throughput (bytes/s), memory storage
+THROUGHPUT_MARGIN   = 0.8           # Share of measured throughput a variant may use
+
+API_PARAMS_PREFIX   = 'v1:'         # Version of api_params URL encoding
+API_PARAMS_ENCODER  = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+
 # Class: DplayPlugin
 class DplayPlugin(Plugin):
     # Get params
@@ -17,8 +26,8 @@ class DplayPlugin(Plugin):
             paramvalue = value[0] if len(value) == 1 else value
             
             if key == 'api_params':
-                # Evaluate api call parameters as a dictionary
-                paramvalue = literal_eval(unquote(paramvalue))
+                # Decode api call parameters as a dictionary
+                paramvalue = decode_api_params(paramvalue)
 
             params[key] = paramvalue
 
@@ -27,9 +36,9 @@ class DplayPlugin(Plugin):
     
     # Get url
     def get_url(self, plugin_url='', **kwargs):
-        # Quote api call parameters
+        # Encode api call parameters
         if 'api_params' in kwargs:
-            kwargs['api_params'] = quote(str(kwargs['api_params']))
+            kwargs['api_params'] = encode_api_params(kwargs['api_params'])
 
         # Super
         return super(DplayPlugin, self).get_url(plugin_url, **kwargs)
@@ -40,4 +49,41 @@ class DplayPlugin(Plugin):
         return 'special://home/addons/%s/resources/%s' % (
             self.id,
             file_name
-        )
\ No newline at end of file
+        )
+
+
+# Encode api call parameters (compact JSON with sorted keys, so equal
+# parameters always give the same URL)
+def encode_api_params(api_params):
+    return API_PARAMS_PREFIX + API_PARAMS_ENCODER.encode(api_params)
+
+
+# Decode api call parameters
+def decode_api_params(value):
+    if value.startswith(API_PARAMS_PREFIX):
+        return json.loads(value[len(API_PARAMS_PREFIX):])
+
+    # Quoted Python literal (URLs from earlier versions, e.g. favourites)
+    return literal_eval(unquote(value))
+
+
+# Variant limits (for hls.select_variant) from settings
+def variant_limits(addon):
+    selection = addon.get_setting('variant_selection')
+
+    # Max resolution
+    if selection == 1:
+        return {'max_height': int(addon.get_setting('max_resolution') or 0)}
+
+    # Max bitrate (kbit/s)
+    if selection == 2:
+        return {'max_bandwidth': int(addon.get_setting('max_bitrate') or 0) * 1000}
+
+    # Measured throughput (unlimited until a download has been measured)
+    if selection == 3:
+        throughput = addon.get_mem_storage('dplay').get(THROUGHPUT_KEY)
+
+        if throughput:
+            return {'max_bandwidth': int(throughput * 8 * THROUGHPUT_MARGIN)}
+
+    return {}
@@ -0,0 +1,414 @@
+# Imports
+import os
+import time
+import logging
+import threading
+from urllib import quote
+
+import xbmc
+import xbmcgui
+
+import hls
+from dplay_plugin import variant_limits, THROUGHPUT_KEY
+from dplay_download import DplayDownloadTask, DownloadCancelled, InsufficientSpace, FileExists, remove_partial
+
+
+# Logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger('[Dplay.%s]' % (__name__))
+
+
+# Constants
+STORAGE         = 'downloads.pcl'
+POLL_INTERVAL   = 5         # Seconds between scheduling rounds
+RETRY_BACKOFF   = 60        # Seconds, doubled for every failed attempt
+STREAM_URL_AGE  = 300       # Seconds a stream URL resolved when queuing is used
+FINISHED_AGE    = 7 * 86400 # Seconds finished (done, failed or cancelled) jobs are kept
+
+QUEUED          = 'queued'
+RUNNING         = 'running'
+FAILED          = 'failed'
+DONE            = 'done'
+CANCELLED       = 'cancelled'
+FINISHED        = (DONE, FAILED, CANCELLED)
+
+
+# Class: DownloadQueue
+class DownloadQueue(object):
+    '''
+    Persistent download queue kept in the addon storage (one entry per
+    video ID). Jobs are ordered by priority (highest first) and then by the
+    time they were added.
+    '''
+
+    # Jobs are read, changed and written back, serialise access within the process
+    lock = threading.Lock()
+
+    # Init
+    def __init__(self, addon):
+        self.addon = addon
+
+
+    # Add job
+    def add(self, video_id, video_full_name, duration, stream_url=None, priority=0):
+        return self.add_all([{
+            'video_id': video_id,
+            'video_full_name': video_full_name,
+            'duration': duration,
+            'stream_url': stream_url,
+            'priority': priority,
+        }]) == 1
+
+
+    # Add jobs (dictionaries with video_id, video_full_name, duration and
+    # optionally stream_url and priority), returns the number of jobs added
+    def add_all(self, jobs):
+        added = 0
+        created = time.time()
+
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            for job in jobs:
+                key = 'job_%s' % (job['video_id'])
+
+                if key in storage and storage[key]['state'] in (QUEUED, RUNNING):
+                    logger.info('Video %s is already queued' % (job['video_id']))
+                    continue
+
+                storage[key] = dict({
+                    'stream_url': None,
+                    'priority': 0,
+                    'state': QUEUED,
+                    'attempts': 0,
+                    'next_attempt': 0,
+                    'created': created,
+                    'position': added, # Order within batch
+                    'error': None,
+                    'resolved': created if job.get('stream_url') else None,
+                }, **job)
+
+                added += 1
+
+        logger.info('Queued %d of %d video(s)' % (added, len(jobs)))
+
+        return added
+
+
+    # Job (None if not queued)
+    def get(self, video_id):
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            return storage.get('job_%s' % (video_id))
+
+
+    # Jobs
+    def jobs(self):
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            jobs = [storage[k] for k in storage if k.startswith('job_')]
+
+        return sorted(jobs, key=lambda j: (-j['priority'], j['created'], j.get('position', 0)))
+
+
+    # Update job (only if in one of the given states), returns False if not updated
+    def update(self, video_id, states=None, **kwargs):
+        key = 'job_%s' % (video_id)
+
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            job = storage.get(key)
+
+            if not job or (states and job['state'] not in states):
+                return False
+
+            job.update(kwargs)
+            storage[key] = job
+
+        return True
+
+
+    # Mark queued job as running, returns False if it is no longer queued
+    def start(self, video_id):
+        key = 'job_%s' % (video_id)
+
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            job = storage.get(key)
+
+            if not job or job['state'] != QUEUED:
+                return False
+
+            job['state'] = RUNNING
+            storage[key] = job
+
+        return True
+
+
+    # Cancel job (a running download is stopped by the scheduler), returns
+    # False if the job is not queued or running
+    def cancel(self, video_id):
+        key = 'job_%s' % (video_id)
+
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            job = storage.get(key)
+
+            if not job or job['state'] not in (QUEUED, RUNNING):
+                return False
+
+            running = job['state'] == RUNNING
+            job.update(state=CANCELLED, finished=time.time())
+            storage[key] = job
+
+        # Partial download of an interrupted attempt
+        if not running:
+            remove_partial(self.addon.get_setting('download_path'), video_id)
+
+        return True
+
+
+    # Retry failed or cancelled job, returns False if the job is not failed or cancelled
+    def retry(self, video_id):
+        key = 'job_%s' % (video_id)
+
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            job = storage.get(key)
+
+            if not job or job['state'] not in (FAILED, CANCELLED):
+                return False
+
+            # Stream URL is resolved again
+            job.update(state=QUEUED, attempts=0, next_attempt=0, error=None, resolved=None, finished=None)
+            storage[key] = job
+
+        return True
+
+
+    # Set priority of job (jobs with higher priority are downloaded first)
+    def set_priority(self, video_id, priority):
+        self.update(video_id, priority=priority)
+
+
+    # Remove job (and partial download), returns False if the job is running
+    def remove(self, video_id):
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            job = storage.get('job_%s' % (video_id))
+
+            if not job or job['state'] == RUNNING:
+                return False
+
+            del storage['job_%s' % (video_id)]
+
+        if job['state'] == QUEUED:
+            remove_partial(self.addon.get_setting('download_path'), video_id)
+
+        return True
+
+
+    # Remove jobs finished before the given time
+    def prune(self, before):
+        with self.lock, self.addon.get_storage(STORAGE) as storage:
+            keys = [k for k in storage if k.startswith('job_')]
+
+            for key in keys:
+                job = storage[key]
+
+                if job['state'] in FINISHED and (job.get('finished') or job['created']) < before:
+                    logger.info('Removing finished job of video %s' % (job['video_id']))
+                    del storage[key]
+
+
+    # Requeue jobs left running (e.g. Kodi was stopped during a download)
+    def requeue_running(self):
+        for job in self.jobs():
+            if job['state'] == RUNNING:
+                self.update(job['video_id'], state=QUEUED)
+
+
+# Class: DownloadScheduler
+class DownloadScheduler(object):
+    '''
+    Runs queued downloads as a Kodi service. At most the configured number
+    of downloads run at the same time, sharing an optional bandwidth cap.
+    Failed downloads are retried with exponential backoff, resolving a
+    fresh stream URL for every retry.
+    '''
+
+    # Init
+    def __init__(self, addon):
+        self.addon = addon
+        self.queue = DownloadQueue(addon)
+        self.monitor = xbmc.Monitor()
+        self.running = {}
+        self.tasks = {}
+        self.rate_limiter = hls.RateLimiter()
+
+
+    # Run
+    def run(self):
+        logger.info('Starting download scheduler')
+
+        self.queue.requeue_running()
+
+        while not self.monitor.abortRequested():
+            self._schedule()
+
+            if self.monitor.waitForAbort(POLL_INTERVAL):
+                break
+
+        logger.info('Stopping download scheduler')
+
+        # Stop running downloads (requeued when the service starts again)
+        for task in self.tasks.values():
+            task.abort()
+
+
+    # Start queued jobs (and stop cancelled ones)
+    def _schedule(self):
+        self.running = {k: t for k, t in self.running.iteritems() if t.is_alive()}
+
+        concurrency = max(1, int(self.addon.get_setting('download_concurrency') or 1))
+        self.rate_limiter.rate = int(self.addon.get_setting('download_max_rate') or 0) * 1024
+
+        now = time.time()
+        jobs = self.queue.jobs()
+
+        if any([j['state'] in FINISHED and (j.get('finished') or j['created']) < now - FINISHED_AGE for j in jobs]):
+            self.queue.prune(now - FINISHED_AGE)
+
+        for job in jobs:
+            if job['state'] == CANCELLED and job['video_id'] in self.tasks:
+                self.tasks[job['video_id']].abort()
+
+        for job in jobs:
+            if len(self.running) >= concurrency:
+                break
+
+            if job['state'] != QUEUED or job['next_attempt'] > now or job['video_id'] in self.running:
+                continue
+
+            thread = threading.Thread(target=self._download, args=(job,))
+            thread.setDaemon(True)
+            thread.start()
+
+            self.running[job['video_id']] = thread
+
+
+    # Resolve stream URL
+    def _resolve(self, video_id):
+        from dplay import Dplay
+
+        playable = Dplay(storage=self.addon.get_mem_storage('dplay')).playable(video_id)
+
+        return playable.streams.get('hls') if playable else None
+
+
+    # Download job
+    def _download(self, job):
+        video_id = job['video_id']
+
+        # Cancelled since scheduled
+        if not self.queue.start(video_id):
+            return
+
+        logger.info('Starting download of video %s (attempt %d)' % (video_id, job['attempts'] + 1))
+
+        dialog = xbmcgui.DialogProgressBG()
+        dialog.create('Dplay', 'Downloading "%s"' % (job['video_full_name']))
+
+        try:
+            # Stream URLs expire, resolve again when retrying or if resolved
+            # long ago (e.g. later jobs of a season)
+            fresh = not job['attempts'] and time.time() - (job.get('resolved') or 0) < STREAM_URL_AGE
+            stream_url = (job['stream_url'] if fresh else None) or self._resolve(video_id)
+
+            if not stream_url:
+                raise Exception('no stream available')
+
+            task = DplayDownloadTask(
+                quote(stream_url),
+                video_id,
+                job['video_full_name'],
+                job['duration'],
+                self.addon.get_setting('download_path'),
+                native=self.addon.get_setting('native_hls') is not False,
+                rate_limiter=self.rate_limiter,
+                cancel_callback=self.monitor.abortRequested,
+                variant_limits=variant_limits(self.addon),
+            )
+
+            self.tasks[video_id] = task
+
+            # Progress (with remaining time predicted from the last measured throughput)
+            throughput = self.addon.get_mem_storage('dplay').get(THROUGHPUT_KEY)
+
+            def progress_callback(progress):
+                if task.estimated_size and throughput:
+                    remaining = task.estimated_size * (100 - progress) / 100.0 / throughput
+                    dialog.update(percent=progress, message='"%s" (ca. %d min)' % (
+                        job['video_full_name'], remaining / 60 + 1
+                    ))
+                else:
+                    dialog.update(percent=progress)
+
+            if not task.start(progress_callback=progress_callback):
+                raise Exception('download failed')
+
+            # Throughput (for variant selection and predictions)
+            if task.throughput:
+                self.addon.get_mem_storage('dplay')[THROUGHPUT_KEY] = task.throughput
+
+        except DownloadCancelled:
+            # Stopped with Kodi, resumed when the service starts again
+            self._finish(video_id, state=QUEUED)
+
+        # Not retried, would fail again
+        except (InsufficientSpace, FileExists) as e:
+            logger.error('Download of video %s not started, %s' % (video_id, str(e)))
+
+            if self._finish(video_id, state=FAILED, error=str(e), finished=time.time()):
+                xbmcgui.Dialog().notification('Dplay', 'Download failed (%s)' % (str(e)))
+
+        except Exception as e:
+            attempts = job['attempts'] + 1
+            retries = int(self.addon.get_setting('download_retries') or 0)
+
+            logger.error('Download of video %s failed (attempt %d), error=%s' % (video_id, attempts, str(e)))
+
+            if attempts > retries:
+                if self._finish(video_id, state=FAILED, attempts=attempts, error=str(e), finished=time.time()):
+                    xbmcgui.Dialog().notification('Dplay', 'Download failed (%s)' % (str(e)))
+            else:
+                self._finish(
+                    video_id,
+                    state=QUEUED,
+                    attempts=attempts,
+                    error=str(e),
+                    next_attempt=time.time() + RETRY_BACKOFF * 2 ** (attempts - 1),
+                )
+
+        else:
+            done = self._finish(
+                video_id,
+                state=DONE,
+                error=None,
+                finished=time.time(),
+                destination=task.destination,
+                size=os.path.getsize(task.destination),
+                throughput=task.throughput,
+            )
+
+            if done:
+                xbmcgui.Dialog().notification('Dplay', 'Done downloading')
+
+        finally:
+            self.tasks.pop(video_id, None)
+            dialog.close()
+
+
+    # Update running job, returns False if it was cancelled by the user meanwhile
+    # (whatever the outcome of the download, its partial download is removed)
+    def _finish(self, video_id, **kwargs):
+        if self.queue.update(video_id, states=(RUNNING,), **kwargs):
+            return True
+
+        logger.info('Download of video %s cancelled' % (video_id))
+
+        remove_partial(self.addon.get_setting('download_path'), video_id)
+        xbmcgui.Dialog().notification('Dplay', 'Download cancelled')
+
+        return False
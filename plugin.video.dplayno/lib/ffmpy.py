@@ -1,8 +1,11 @@
 import errno
 import shlex
+import signal
+import select
 import subprocess
+import time
 import os
-import re
+from collections import deque
 
 __version__ = '0.2.2'
 
@@ -34,11 +37,14 @@ class FFtool(object):
             stdin = subprocess.PIPE
 
         try:
+            # Own process group, see terminate()
             self.process = subprocess.Popen(
                 self._cmd,
                 stdin=stdin,
                 stdout=stdout,
-                stderr=stderr
+                stderr=stderr,
+                preexec_fn=os.setsid if hasattr(os, 'setsid') else None,
+                creationflags=getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)
             )
         except OSError as e:
             if e.errno == errno.ENOENT:
@@ -47,6 +53,44 @@ class FFtool(object):
             else:
                 raise
 
+    def terminate(self, timeout=5):
+        """Interrupt the process group, kill it if still running after ``timeout`` seconds.
+
+        On Windows the process group is interrupted with ``CTRL_BREAK_EVENT`` and the process is
+        killed with ``TerminateProcess``.
+        """
+        if self.process is None or self.process.poll() is not None:
+            return
+
+        self._interrupt()
+
+        deadline = time.time() + timeout
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+
+        if self.process.poll() is None:
+            self._kill()
+            self.process.wait()
+
+    def _interrupt(self):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(self.process.pid, signal.SIGINT)
+            else:
+                self.process.send_signal(signal.CTRL_BREAK_EVENT)
+        except (OSError, ValueError, AttributeError):
+            pass  # Already exited or not supported, killed after the timeout
+
+    def _kill(self):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.terminate()
+        except OSError:
+            pass  # Already exited
+
+
 class FFmpeg(FFtool):
     """Wrapper for various `FFmpeg <https://www.ffmpeg.org/>`_ related applications (ffmpeg,
     ffprobe).
@@ -83,7 +127,8 @@ class FFmpeg(FFtool):
         super(FFmpeg, self).__init__(executable, global_options, inputs, outputs)
         self.update_size = update_size
 
-    def run(self, input_data=None, stdin=None, stdout=None, on_progress=None):
+    def run(self, input_data=None, stdin=None, stdout=None, on_progress=None, should_stop=None,
+            duration=None):
         """Execute FFmpeg command line.
 
         ``input_data`` can contain input for FFmpeg in case ``pipe`` protocol is used for input.
@@ -105,79 +150,120 @@ class FFmpeg(FFtool):
         :param stdin: replace FFmpeg ``stdin`` (default is `None` which means `subprocess.PIPE`)
         :param stdout: redirect FFmpeg ``stdout`` there (default is `None` which means no
             redirection)
+        :param on_progress: called with an `FFstate` for every progress update (requires
+            ``-progress pipe:2`` in the global options)
+        :param should_stop: called while waiting, the process is terminated and
+            `FFCancelledError` raised when it returns True
+        :param float duration: duration of the input in seconds, for progress percentage and ETA
         :return: a 2-tuple containing ``stdout`` and ``stderr`` of the process
         :rtype: tuple
         :raise: `FFRuntimeError` in case FFmpeg command exits with a non-zero code;
-            `FFExecutableNotFoundError` in case the executable path passed was not valid
+            `FFExecutableNotFoundError` in case the executable path passed was not valid;
+            `FFCancelledError` in case ``should_stop`` returned True
         """
         self.start(input_data, stdin, stdout, subprocess.PIPE)
-        return [None, self.wait(on_progress)]
+        return [None, self.wait(on_progress, should_stop=should_stop, duration=duration)]
 
-    def wait(self, on_progress=None, stderr_ring_size=30):
-        stderr_ring = []
-        is_running = True
+    def wait(self, on_progress=None, stderr_ring_size=30, should_stop=None, duration=None,
+             poll_interval=1.0):
+        stderr_ring = deque(maxlen=stderr_ring_size)
         stderr_fileno = self.process.stderr.fileno()
-        ff_state = FFstate()
-        while is_running:
-            latest_update = os.read(stderr_fileno, self.update_size)
-            if ff_state.consume(latest_update) and on_progress is not None:
-                on_progress(ff_state)
-            stderr_ring.append(latest_update.decode())
-            if len(stderr_ring) > stderr_ring_size:
-                del stderr_ring[0]
-            is_running = self.process.poll() is None
-
-        stderr_out = str.join("", stderr_ring)
+        ff_state = FFstate(duration)
+        # select() does not support pipes on Windows, read blocking there
+        can_select = os.name == 'posix'
+
+        try:
+            while True:
+                if should_stop is not None and should_stop():
+                    self.terminate()
+                    raise FFCancelledError(self.cmd)
+
+                if can_select and not select.select([stderr_fileno], [], [], poll_interval)[0]:
+                    continue
+
+                latest_update = os.read(stderr_fileno, self.update_size)
+                if not latest_update:
+                    break
+
+                if ff_state.consume(latest_update) and on_progress is not None:
+                    on_progress(ff_state)
+                stderr_ring.append(latest_update)
+        finally:
+            self.process.stderr.close()
+
+        self.process.wait()
+
+        stderr_out = b''.join(stderr_ring)
         if self.process.returncode != 0:
             raise FFRuntimeError(self.cmd, self.process.returncode, stderr_out)
 
         return stderr_out
 
 
-class FFstate:
-    def __init__(self):
+class FFstate(object):
+    """Progress of an FFmpeg process, parsed from ``-progress`` output.
+
+    FFmpeg writes blocks of ``key=value`` lines, each block ending with a ``progress`` line
+    (``continue`` or ``end``). Output can be consumed in chunks of any size.
+
+    :param float duration: duration of the input in seconds (optional)
+    """
+
+    def __init__(self, duration=None):
+        self.duration = duration
         self.frame = None
         self.fps = None
-        self.size = None
-        self.time = None
+        self.size = None   # Bytes written
+        self.time = None   # Seconds written
+        self.speed = None  # Relative to realtime
+        self.done = False
+        self._values = {}
+        self._remainder = b''
 
     def consume(self, update):
-        raw_update_dict = {}
-        for match in re.finditer(r"(?P<key>\S+)=\s*(?P<value>\S+)", update.decode()):
-            raw_update_dict[match.group("key")] = match.group("value")
-        updated = self.update_frame(raw_update_dict.get("frame")) + \
-            self.update_fps(raw_update_dict.get("fps")) + \
-            self.update_size(raw_update_dict.get("size") or raw_update_dict.get("Lsize", "")) + \
-            self.update_time(raw_update_dict.get("time", ""))
-        return updated > 0
-
-    def update_frame(self, raw_frame):
-        if raw_frame is not None:
-            self.frame = int(raw_frame)
-            return True
-        return False
-
-    def update_fps(self, fps_raw):
-        if fps_raw is not None:
-            self.fps = float(fps_raw)
-            return True
-        return False
-
-    def update_size(self, raw_size):
-        digits_match = re.match(r"(?P<size_in_kb>\d+)kB", raw_size)
-        if digits_match is not None:
-            self.size = int(digits_match.group("size_in_kb")) * 1000
-            return True
-        return False
-
-    def update_time(self, raw_time):
-        time_units_match = re.match(
-            r"(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+.\d+)", raw_time)
-        if time_units_match is not None:
-            self.time = int(time_units_match.group("hours")) * 3600 + int(
-                time_units_match.group("minutes")) * 60 + float(time_units_match.group("seconds"))
-            return True
-        return False
+        """Consume output, returns True if at least one progress block was completed."""
+        lines = (self._remainder + update).split(b'\n')
+        self._remainder = lines.pop()
+
+        updated = False
+        for line in lines:
+            key, separator, value = line.rstrip(b'\r').partition(b'=')
+            if not separator:
+                continue
+            if key == b'progress':
+                self._update(value == b'end')
+                updated = True
+            else:
+                self._values[key] = value.strip()
+        return updated
+
+    def _update(self, done):
+        values = self._values
+        self.frame = _parse_number(values.get(b'frame'), int, self.frame)
+        self.fps = _parse_number(values.get(b'fps'), float, self.fps)
+        self.size = _parse_number(values.get(b'total_size'), int, self.size)
+        # out_time_ms is in microseconds as well (out_time_us in newer versions)
+        out_time = _parse_number(values.get(b'out_time_us') or values.get(b'out_time_ms'), int)
+        if out_time is not None:
+            self.time = out_time / 1000000.0
+        self.speed = _parse_number((values.get(b'speed') or b'').rstrip(b'x'), float, self.speed)
+        self.done = done
+
+    @property
+    def percent(self):
+        """Percentage of the duration written (None if unknown)."""
+        if self.done:
+            return 100
+        if not self.duration or self.time is None:
+            return None
+        return min(100, int(self.time * 100 / self.duration))
+
+    @property
+    def eta(self):
+        """Estimated seconds left (None if unknown)."""
+        if not self.duration or self.time is None or not self.speed:
+            return None
+        return max(0, (self.duration - self.time) / self.speed)
 
 
 class FFprobe(FFtool):
@@ -214,6 +300,10 @@ class FFExecutableNotFoundError(Exception):
     """Raise when FFmpeg/FFprobe executable was not found."""
 
 
+class FFCancelledError(Exception):
+    """Raise when FFmpeg execution was cancelled."""
+
+
 class FFRuntimeError(Exception):
     """Raise when FFmpeg/FFprobe command line execution returns a non-zero exit code.
 
@@ -245,6 +335,19 @@ def _is_sequence(obj):
     return hasattr(obj, '__iter__') and not isinstance(obj, str)
 
 
+def _parse_number(raw, type_, default=None):
+    """Parse a number from FFmpeg output (e.g. ``N/A`` for unknown values).
+
+    :param str raw: the raw value
+    :param type type_: `int` or `float`
+    :param default: returned if the value can not be parsed
+    """
+    try:
+        return type_(raw)
+    except (TypeError, ValueError):
+        return default
+
+
 def _merge_args_opts(args_opts_dict, **kwargs):
     """Merge options with their corresponding arguments.
 
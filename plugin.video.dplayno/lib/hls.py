@@ -0,0 +1,431 @@
+# Imports
+import os
+import re
+import json
+import time
+import logging
+import threading
+import requests
+from urlparse import urljoin
+
+from dplay.workers import imap
+
+
+# Logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger('[Dplay.%s]' % (__name__))
+
+
+# Constants
+SEGMENT_WORKERS = 4
+SEGMENT_WINDOW  = 16 # Segments started ahead of the one being written
+SEGMENT_RETRIES = 3
+TIMEOUT         = 30
+
+ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+# Class: HLSError
+class HLSError(Exception):
+    pass
+
+
+# Class: HLSUnsupportedError
+class HLSUnsupportedError(HLSError):
+    pass
+
+
+# Class: HLSCancelledError
+class HLSCancelledError(HLSError):
+    pass
+
+
+# Parse attribute list (e.g. BANDWIDTH=1280000,RESOLUTION=1280x720)
+def parse_attributes(line):
+    return {k: v.strip('"') for k, v in ATTRIBUTE.findall(line.split(':', 1)[-1])}
+
+
+# Class: Variant
+class Variant(object):
+    # Init
+    def __init__(self, url, attributes):
+        self.url = url
+        self.bandwidth = int(attributes.get('BANDWIDTH', 0))
+        self.resolution = attributes.get('RESOLUTION')
+        self.codecs = attributes.get('CODECS')
+        self.groups = {t: attributes[t] for t in ('AUDIO', 'SUBTITLES') if t in attributes}
+        self.alternates = [] # Renditions (EXT-X-MEDIA attributes) in own playlists
+
+
+    # Height
+    @property
+    def height(self):
+        return int(self.resolution.split('x')[-1]) if self.resolution else None
+
+
+    # Representation
+    def __repr__(self):
+        return '<Variant: bandwidth=%d, resolution=%s>' % (self.bandwidth, self.resolution)
+
+
+# Class: MediaPlaylist
+class MediaPlaylist(object):
+    # Init
+    def __init__(self, url, segments, init_segment=None, key_method=None, target_duration=None):
+        self.url = url
+        self.segments = segments
+        self.init_segment = init_segment
+        self.key_method = key_method
+        self.target_duration = target_duration
+
+
+    # Encrypted
+    @property
+    def encrypted(self):
+        return self.key_method not in (None, 'NONE')
+
+
+# Parse master playlist
+def parse_master(text, base_url):
+    '''
+    Returns the variants of a master playlist. Alternate audio and subtitle
+    renditions (EXT-X-MEDIA) with their own playlists are set as alternates
+    of the variants referencing their group.
+    '''
+    variants = []
+    renditions = []
+    attributes = None
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        if line.startswith('#EXT-X-STREAM-INF'):
+            attributes = parse_attributes(line)
+
+        elif line.startswith('#EXT-X-MEDIA:'):
+            renditions.append(parse_attributes(line))
+
+        elif line and not line.startswith('#') and attributes is not None:
+            variants.append(Variant(urljoin(base_url, line), attributes))
+            attributes = None
+
+    for variant in variants:
+        variant.alternates = [
+            r for r in renditions if r.get('URI') and variant.groups.get(r.get('TYPE')) == r.get('GROUP-ID')
+        ]
+
+    return variants
+
+
+# Parse media playlist
+def parse_media(text, base_url):
+    segments = []
+    init_segment = None
+    key_method = None
+    target_duration = None
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        if line.startswith('#EXT-X-TARGETDURATION'):
+            target_duration = int(line.split(':', 1)[1])
+
+        elif line.startswith('#EXT-X-KEY'):
+            key_method = parse_attributes(line).get('METHOD')
+
+        elif line.startswith('#EXT-X-MAP'):
+            init_segment = urljoin(base_url, parse_attributes(line).get('URI'))
+
+        elif line and not line.startswith('#'):
+            segments.append(urljoin(base_url, line))
+
+    return MediaPlaylist(base_url, segments, init_segment, key_method, target_duration)
+
+
+# Select variant
+def select_variant(variants, max_height=None, max_bandwidth=None):
+    '''
+    Select the variant with the highest bandwidth within the given limits
+    (video height in lines, bandwidth in bits per second). Falls back to the
+    lowest bandwidth variant if none are within the limits.
+    '''
+    if not variants:
+        return None
+
+    within = [v for v in variants if all([
+        not max_height or not v.height or v.height <= max_height,
+        not max_bandwidth or v.bandwidth <= max_bandwidth,
+    ])]
+
+    if not within:
+        return min(variants, key=lambda v: v.bandwidth)
+
+    return max(within, key=lambda v: v.bandwidth)
+
+
+# Fetch variants of master playlist
+def fetch_variants(url, session=None):
+    '''
+    Returns the variants of the master playlist at url (an empty list if it
+    is not a master playlist).
+    '''
+    r = (session or requests).get(url, timeout=TIMEOUT)
+    r.raise_for_status()
+
+    return parse_master(r.content, url)
+
+
+# Resolve variant (media playlist URL) of master playlist
+def resolve_variant(url, session=None, **limits):
+    '''
+    Returns the URL of the variant selected from the master playlist at url
+    (see select_variant), or url itself if it is not a master playlist or
+    the variant has alternate renditions (which the variant playlist alone
+    would lose).
+    '''
+    variant = select_variant(fetch_variants(url, session), **limits)
+
+    if not variant:
+        return url
+
+    if variant.alternates:
+        logger.info('Selected %s has alternate renditions, keeping master playlist' % (variant))
+        return url
+
+    logger.info('Selected %s' % (variant))
+
+    return variant.url
+
+
+# Class: RateLimiter
+class RateLimiter(object):
+    '''
+    Token bucket limiting the combined download rate (bytes per second) of
+    all downloaders sharing it. A rate of 0 disables the limit. The rate may
+    be changed while downloads are running.
+    '''
+
+    # Init
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.allowance = 0
+        self.updated = time.time()
+
+
+    # Consume (blocks until the bytes are within the limit)
+    def consume(self, size):
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.time()
+
+            # Refill (at most one second worth of burst)
+            self.allowance = min(self.rate, self.allowance + (now - self.updated) * self.rate) - size
+            self.updated = now
+
+            delay = -self.allowance / float(self.rate) if self.allowance < 0 else 0
+
+        if delay:
+            time.sleep(delay)
+
+
+# Class: Journal
+class Journal(object):
+    '''
+    On-disk (JSON) record of a segment download, used to resume an
+    interrupted download. Keeps the selected variant bandwidth, the number of
+    segments, the temporary file and, after each written segment, the number
+    of completed segments and the byte offset of the temporary file.
+    '''
+
+    # Init
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+
+    # Get
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+    # Update and save
+    def update(self, **kwargs):
+        self.data.update(kwargs)
+
+        with open(self.path, 'w') as f:
+            json.dump(self.data, f)
+
+
+    # Remove
+    def remove(self):
+        self.data = {}
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Class: HLSDownloader
+class HLSDownloader(object):
+    '''
+    Downloads an HLS stream by fetching the media segments concurrently over
+    a pooled session and writing them in order to a single file. Transport
+    stream segments are concatenated, fragmented MP4 segments are written
+    after their init segment. Encrypted streams are not supported.
+    '''
+
+    # Init
+    def __init__(self, url, session=None, workers=SEGMENT_WORKERS, rate_limiter=None, variant_limits=None):
+        self.url = url
+        self.workers = workers
+        self.rate_limiter = rate_limiter
+        self.variant_limits = variant_limits or {}
+        self.session = session or requests.Session()
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.variant = None
+        self.playlist = None
+        self.throughput = None # Bytes per second of last download
+
+
+    # Extension of downloaded file
+    @property
+    def extension(self):
+        return '.mp4' if self.playlist and self.playlist.init_segment else '.ts'
+
+
+    # Fetch
+    def _fetch(self, url):
+        for attempt in range(1, SEGMENT_RETRIES + 1):
+            try:
+                r = self.session.get(url, timeout=TIMEOUT)
+                r.raise_for_status()
+
+                if self.rate_limiter:
+                    self.rate_limiter.consume(len(r.content))
+
+                return r.content
+
+            except requests.RequestException as e:
+                logger.warning('Fetching %s failed (attempt %d), %s' % (url, attempt, str(e)))
+
+                if attempt == SEGMENT_RETRIES:
+                    raise HLSError('could not fetch %s' % (url))
+
+
+    # Prepare (resolve variant and media playlist)
+    def prepare(self, bandwidth=None):
+        playlist = self._fetch(self.url)
+        variants = parse_master(playlist, self.url)
+
+        if variants:
+            # Same variant as a previous (resumed) download, if available
+            self.variant = next(
+                (v for v in variants if v.bandwidth == bandwidth), None
+            ) or select_variant(variants, **self.variant_limits)
+
+            logger.info('Selected %s of %d variant(s)' % (self.variant, len(variants)))
+
+            # Only the variant playlist is downloaded, audio or subtitles in
+            # own playlists would be missing
+            if self.variant.alternates:
+                raise HLSUnsupportedError('alternate renditions (%s) are not supported' % (
+                    ', '.join(sorted(set([r.get('TYPE') for r in self.variant.alternates])))
+                ))
+
+            self.playlist = parse_media(self._fetch(self.variant.url), self.variant.url)
+
+        else:
+            self.playlist = parse_media(playlist, self.url)
+
+        if self.playlist.encrypted:
+            raise HLSUnsupportedError('encrypted streams (%s) are not supported' % (self.playlist.key_method))
+
+        if not self.playlist.segments:
+            raise HLSUnsupportedError('no segments in playlist')
+
+        logger.info('Media playlist has %d segment(s)' % (len(self.playlist.segments)))
+
+        return self.playlist
+
+
+    # Download
+    def download(self, destination, progress_callback=None, journal=None, cancel_callback=None):
+        if not self.playlist:
+            self.prepare()
+
+        segments = self.playlist.segments
+        total = len(segments)
+        completed = 0
+        started = time.time()
+
+        # Resume from journal if it matches the playlist and temporary file
+        if journal and self._can_resume(journal, destination, total):
+            completed = journal.get('completed')
+
+            logger.info('Resuming at segment %d of %d (offset %d)' % (
+                completed + 1, total, journal.get('offset')
+            ))
+
+            f = open(destination, 'r+b')
+            f.seek(journal.get('offset'))
+            f.truncate()
+
+        else:
+            f = open(destination, 'wb')
+
+            if self.playlist.init_segment:
+                f.write(self._fetch(self.playlist.init_segment))
+
+            if journal:
+                journal.update(
+                    bandwidth=self.variant.bandwidth if self.variant else None,
+                    segments=total,
+                    temporary=destination,
+                    completed=0,
+                    offset=f.tell(),
+                )
+
+        with f:
+            offset = f.tell()
+
+            for index, content in enumerate(imap(self._fetch, segments[completed:], self.workers, SEGMENT_WINDOW), completed + 1):
+                if cancel_callback and cancel_callback():
+                    raise HLSCancelledError('download cancelled at segment %d of %d' % (index, total))
+
+                f.write(content)
+                f.flush()
+
+                if journal:
+                    journal.update(completed=index, offset=f.tell())
+
+                if progress_callback:
+                    progress_callback(int(index * 100 / total))
+
+            self.throughput = (f.tell() - offset) / max(time.time() - started, 0.001)
+
+        logger.info('Downloaded %d segment(s) at %d kB/s' % (total - completed, self.throughput / 1024))
+
+        return destination
+
+
+    # Check if journal can be used to resume download
+    def _can_resume(self, journal, destination, total):
+        return all([
+            journal.get('temporary') == destination,
+            journal.get('segments') == total,
+            journal.get('completed', 0) > 0,
+            os.path.exists(destination),
+            os.path.exists(destination) and os.path.getsize(destination) >= journal.get('offset', 0),
+        ])
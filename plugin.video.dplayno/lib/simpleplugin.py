@@ -13,6 +13,7 @@ import sys
 import re
 import inspect
 import time
+import sqlite3
 import cPickle as pickle
 from urlparse import parse_qs, urlparse
 from urllib import urlencode, quote_plus, unquote_plus
@@ -21,7 +22,6 @@ from collections import MutableMapping, namedtuple
 from copy import deepcopy
 from types import GeneratorType
 from hashlib import md5
-from shutil import copyfile
 from contextlib import contextmanager
 from pprint import pformat
 from platform import uname
@@ -40,6 +40,16 @@ ListContext = namedtuple('ListContext', ['listing', 'succeeded',
 PlayContext = namedtuple('PlayContext', ['path', 'play_item', 'succeeded'])
 Route = namedtuple('Route', ['pattern', 'func'])
 
+STORAGE_TIMEOUT = 5.0  # Seconds to wait for a locked storage database
+LISTING_CHUNK_SIZE = 100  # Items added per call for listings of unknown size (generators)
+CACHE_MAX_ENTRIES = 500  # Cached function results kept per cache
+CACHE_MAX_BYTES = 4 * 1024 * 1024  # Pickled size of cached results kept per cache
+CACHE_SWEEP_INTERVAL = 600  # Seconds between removals of expired cache entries
+CACHE_EVICT_RATIO = 0.9  # Share of the bounds kept by eviction, so the next sweep is not due at once
+CACHE_STATS_KEY = '__cache_stats__'
+
+_kodi_version = {}
+
 
 class SimplePluginError(Exception):
     """Custom exception"""
@@ -67,6 +77,48 @@ def _format_vars(variables):
     return '\n'.join(lines)
 
 
+def _normalize_cache_arg(value):
+    """
+    Normalize a cached function argument for its cache key
+
+    Dictionaries and sets are sorted, lists and tuples are treated alike,
+    and unicode strings are UTF-8 encoded, so equivalent arguments give the same key.
+    Other objects are represented by their ``repr()``, or by their class and
+    attributes if they use the default ``repr()`` (which only shows the object address).
+
+    :param value: argument value
+    :return: normalized value
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (str, bool, int, long, float, type(None))):
+        return value
+    if isinstance(value, dict):
+        return {'dict': sorted((_normalize_cache_arg(key), _normalize_cache_arg(val))
+                               for key, val in value.iteritems())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_cache_arg(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return {'set': sorted(_normalize_cache_arg(item) for item in value)}
+    if type(value).__repr__ is object.__repr__ and hasattr(value, '__dict__'):
+        cls = value.__class__
+        return {'object': '{0}.{1}'.format(cls.__module__, cls.__name__),
+                'attributes': _normalize_cache_arg(vars(value))}
+    return {'repr': repr(value)}
+
+
+def get_kodi_major_version():
+    """
+    Get Kodi major version (read from Kodi once)
+
+    :return: the first 2 characters of Kodi build version, e.g. ``'17'``
+    :rtype: str
+    """
+    if 'major' not in _kodi_version:
+        _kodi_version['major'] = xbmc.getInfoLabel('System.BuildVersion')[:2]
+    return _kodi_version['major']
+
+
 @contextmanager
 def debug_exception(logger=None):
     """
@@ -162,6 +214,11 @@ class Storage(MutableMapping):
     It is designed as a context manager and better be used
     with 'with' statement.
 
+    Contents are kept in an SQLite database (in WAL mode) with one row per key,
+    so only the keys that are accessed are read and written. The database file
+    is named after ``filename`` with a ``.sqlite`` extension, contents of an
+    existing pickle file by that name are migrated on first use.
+
     :param storage_dir: directory for storage
     :type storage_dir: str
     :param filename: the name of a storage file (optional)
@@ -174,7 +231,8 @@ class Storage(MutableMapping):
             value2 = storage['key2']
 
     .. note:: After exiting :keyword:`with` block a :class:`Storage` instance is invalidated.
-        Storage contents are saved to disk only for a new storage or if the contents have been changed.
+        Changes are committed to disk when the block is exited (or :meth:`flush` is called).
+        Mutable values that have been read and changed in place are saved as well.
     """
     def __init__(self, storage_dir, filename='storage.pcl'):
         """
@@ -183,16 +241,37 @@ class Storage(MutableMapping):
         :type storage_dir: str
         :type filename: str
         """
-        self._storage = {}
-        self._hash = None
-        self._filename = os.path.join(storage_dir, filename)
+        self._filename = os.path.join(storage_dir, os.path.splitext(filename)[0] + '.sqlite')
+        self._read = {}  # Mutable values read, key: (value, pickled value)
+        migrate = not os.path.exists(self._filename)
+        self._connection = sqlite3.connect(self._filename, timeout=STORAGE_TIMEOUT)
+        self._connection.text_factory = str
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS storage (key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)'
+        )
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(storage)')]
+        if 'accessed' not in columns:
+            self._connection.execute('ALTER TABLE storage ADD COLUMN accessed REAL')
+        if migrate:
+            self._migrate(os.path.join(storage_dir, filename))
+
+    def _migrate(self, pickle_filename):
+        """
+        Copy contents of a pickle storage file (the previous storage format)
+
+        :type pickle_filename: str
+        """
         try:
-            with open(self._filename, 'rb') as fo:
-                contents = fo.read()
-            self._storage = pickle.loads(contents)
-            self._hash = md5(contents).hexdigest()
+            with open(pickle_filename, 'rb') as fo:
+                contents = pickle.load(fo)
         except (IOError, pickle.PickleError, EOFError, AttributeError):
-            pass
+            return
+        for key, value in contents.iteritems():
+            self[key] = value
+        self._connection.commit()
+        os.remove(pickle_filename)
 
     def __enter__(self):
         return self
@@ -201,51 +280,155 @@ class Storage(MutableMapping):
         self.flush()
 
     def __getitem__(self, key):
-        return self._storage[key]
+        if key in self._read:
+            return self._read[key][0]
+        row = self._connection.execute(
+            'SELECT value FROM storage WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self._key(key), time.time())
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = pickle.loads(str(row[0]))
+        if not isinstance(value, (basestring, int, long, float, bool, type(None))):
+            self._read[key] = (value, str(row[0]))
+        return value
 
     def __setitem__(self, key, value):
-        self._storage[key] = value
+        self.set(key, value)
 
     def __delitem__(self, key):
-        del self._storage[key]
+        self._read.pop(key, None)
+        cursor = self._connection.execute('DELETE FROM storage WHERE key = ?', (self._key(key),))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._read:
+            return True
+        return self._connection.execute(
+            'SELECT 1 FROM storage WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self._key(key), time.time())
+        ).fetchone() is not None
 
     def __iter__(self):
-        return iter(self._storage)
+        return iter(self.keys())
 
     def __len__(self):
-        return len(self._storage)
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM storage WHERE expires IS NULL OR expires > ?', (time.time(),)
+        ).fetchone()[0]
 
     def __str__(self):
-        return '<Storage {0}>'.format(self._storage)
+        return '<Storage {0}>'.format(self.copy())
 
     def __repr__(self):
-        return '<simpleplugin.Storage object {0}>'.format(self._storage)
+        return '<simpleplugin.Storage object {0}>'.format(self.copy())
+
+    @staticmethod
+    def _key(key):
+        """
+        :rtype: str
+        """
+        return key.encode('utf-8') if isinstance(key, unicode) else key
+
+    def keys(self):
+        """
+        Get storage keys (without expired keys)
+
+        :rtype: list
+        """
+        return [row[0] for row in self._connection.execute(
+            'SELECT key FROM storage WHERE expires IS NULL OR expires > ?', (time.time(),)
+        )]
+
+    def set(self, key, value, expires=None):
+        """
+        Set a value with an optional expiry time
+
+        Expired values are treated as missing and removed by :meth:`purge_expired`.
+        Setting a value also updates its last access time (see :meth:`evict`).
+
+        :param key: storage key
+        :type key: str
+        :param value: a picklable value
+        :param expires: expiry time as a Unix timestamp (optional)
+        :type expires: float
+        """
+        self._read.pop(key, None)
+        self._connection.execute(
+            'INSERT OR REPLACE INTO storage (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+            (self._key(key), sqlite3.Binary(pickle.dumps(value, protocol=2)), expires, time.time())
+        )
+
+    def touch(self, key):
+        """
+        Update the last access time of a value
+
+        :param key: storage key
+        :type key: str
+        """
+        self._connection.execute(
+            'UPDATE storage SET accessed = ? WHERE key = ?', (time.time(), self._key(key))
+        )
+
+    def purge_expired(self):
+        """
+        Remove expired values
+
+        :return: the number of removed values
+        :rtype: int
+        """
+        return self._connection.execute(
+            'DELETE FROM storage WHERE expires <= ?', (time.time(),)
+        ).rowcount
+
+    def evict(self, max_entries=None, max_bytes=None):
+        """
+        Remove least recently used values while the storage is over its bounds
+
+        Values are ordered by the time they were last set or touched (see :meth:`touch`).
+
+        :param max_entries: maximum number of values (optional)
+        :type max_entries: int
+        :param max_bytes: maximum pickled size of values (optional)
+        :type max_bytes: int
+        :return: the number of removed values
+        :rtype: int
+        """
+        count, size = self._connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM storage'
+        ).fetchone()
+
+        def over():
+            return (max_entries is not None and count > max_entries or
+                    max_bytes is not None and size > max_bytes)
+
+        evicted = 0
+        if over():
+            for key, length in self._connection.execute(
+                    'SELECT key, LENGTH(value) FROM storage ORDER BY accessed').fetchall():
+                if not over():
+                    break
+                self._read.pop(key, None)
+                self._connection.execute('DELETE FROM storage WHERE key = ?', (key,))
+                count -= 1
+                size -= length
+                evicted += 1
+        return evicted
 
     def flush(self):
         """
         Save storage contents to disk
 
-        This method saves new and changed :class:`Storage` contents to disk
-        and invalidates the Storage instance. Unchanged Storage is not saved
-        but simply invalidated.
-        """
-        contents = pickle.dumps(self._storage, protocol=2)
-        if self._hash is None or md5(contents).hexdigest() != self._hash:
-            tmp = self._filename + '.tmp'
-            start = time.time()
-            while os.path.exists(tmp):
-                if time.time() - start > 2.0:
-                    raise TimeoutError(
-                        'Exceeded timeout for saving {0} contents!'.format(self)
-                    )
-                xbmc.sleep(100)
-            try:
-                with open(tmp, 'wb') as fo:
-                    fo.write(contents)
-                copyfile(tmp, self._filename)
-            finally:
-                os.remove(tmp)
-        del self._storage
+        This method commits changes (including mutable values read and changed in place)
+        and invalidates the Storage instance.
+        """
+        for key, (value, contents) in self._read.items():
+            if pickle.dumps(value, protocol=2) != contents:
+                self.set(key, value)
+        self._connection.commit()
+        self._connection.close()
+        del self._connection
 
     def copy(self):
         """
@@ -256,7 +439,7 @@ class Storage(MutableMapping):
         :return: a copy of storage contents
         :rtype: dict
         """
-        return deepcopy(self._storage)
+        return deepcopy(dict((key, self[key]) for key in self.keys()))
 
 
 class MemStorage(MutableMapping):
@@ -270,6 +453,9 @@ class MemStorage(MutableMapping):
 
     .. note:: Keys are case-insensitive
 
+    Values may be set with an expiry time (see :meth:`set`). The expiry time,
+    last access time and size of each value are kept in a separate property.
+
     .. warning:: :class:`MemStorage` does not allow to modify mutable objects
         in place! You need to assign them to variables first, modify and
         store them back to a MemStorage instance.
@@ -323,23 +509,40 @@ class MemStorage(MutableMapping):
     def __repr__(self):
         return '<simpleplugin.MemStorage object {{{0}}}'.format(self._format_contents())
 
+    def _get_meta(self, key):
+        """
+        :return: expiry time, last access time and size of a value (``None`` if not known)
+        :rtype: tuple
+        """
+        raw_meta = self._window.getProperty('{0}__meta__{1}'.format(self._id, key))
+        if raw_meta:
+            return pickle.loads(raw_meta)
+        return None
+
+    def _set_meta(self, key, meta):
+        """
+        :type meta: tuple
+        """
+        self._window.setProperty('{0}__meta__{1}'.format(self._id, key), pickle.dumps(meta))
+
+    def _is_expired(self, key):
+        """
+        :rtype: bool
+        """
+        meta = self._get_meta(key)
+        return meta is not None and meta[0] is not None and meta[0] <= time.time()
+
     def __getitem__(self, key):
         self._check_key(key)
         full_key = '{0}__{1}'.format(self._id, key)
         raw_item = self._window.getProperty(full_key)
-        if raw_item:
+        if raw_item and (key == '__keys__' or not self._is_expired(key)):
             return pickle.loads(raw_item)
         else:
             raise KeyError(key)
 
     def __setitem__(self, key, value):
-        self._check_key(key)
-        full_key = '{0}__{1}'.format(self._id, key)
-        self._window.setProperty(full_key, pickle.dumps(value))
-        if key != '__keys__':
-            keys = self['__keys__']
-            keys.append(key)
-            self['__keys__'] = keys
+        self.set(key, value)
 
     def __delitem__(self, key):
         self._check_key(key)
@@ -348,8 +551,10 @@ class MemStorage(MutableMapping):
         if item:
             self._window.clearProperty(full_key)
             if key != '__keys__':
+                self._window.clearProperty('{0}__meta__{1}'.format(self._id, key))
                 keys = self['__keys__']
-                keys.remove(key)
+                while key in keys:  # Older versions could store a key more than once
+                    keys.remove(key)
                 self['__keys__'] = keys
         else:
             raise KeyError(key)
@@ -358,7 +563,7 @@ class MemStorage(MutableMapping):
         self._check_key(key)
         full_key = '{0}__{1}'.format(self._id, key)
         item = self._window.getProperty(full_key)
-        if item:
+        if item and (key == '__keys__' or not self._is_expired(key)):
             return True
         return False
 
@@ -368,6 +573,93 @@ class MemStorage(MutableMapping):
     def __len__(self):
         return len(self['__keys__'])
 
+    def set(self, key, value, expires=None):
+        """
+        Set a value with an optional expiry time
+
+        Expired values are treated as missing and removed by :meth:`purge_expired`.
+        Setting a value also updates its last access time (see :meth:`evict`).
+
+        :param key: storage key
+        :type key: str
+        :param value: a picklable value
+        :param expires: expiry time as a Unix timestamp (optional)
+        :type expires: float
+        """
+        self._check_key(key)
+        full_key = '{0}__{1}'.format(self._id, key)
+        raw_item = pickle.dumps(value)
+        self._window.setProperty(full_key, raw_item)
+        if key != '__keys__':
+            self._set_meta(key, (expires, time.time(), len(raw_item)))
+            keys = self['__keys__']
+            if key not in keys:
+                keys.append(key)
+                self['__keys__'] = keys
+
+    def touch(self, key):
+        """
+        Update the last access time of a value
+
+        :param key: storage key
+        :type key: str
+        """
+        self._check_key(key)
+        meta = self._get_meta(key)
+        if meta is not None:
+            self._set_meta(key, (meta[0], time.time(), meta[2]))
+
+    def purge_expired(self):
+        """
+        Remove expired values
+
+        :return: the number of removed values
+        :rtype: int
+        """
+        expired = [key for key in set(self['__keys__']) if self._is_expired(key)]
+        for key in expired:
+            del self[key]
+        return len(expired)
+
+    def evict(self, max_entries=None, max_bytes=None):
+        """
+        Remove least recently used values while the storage is over its bounds
+
+        Values are ordered by the time they were last set or touched (see :meth:`touch`).
+
+        :param max_entries: maximum number of values (optional)
+        :type max_entries: int
+        :param max_bytes: maximum pickled size of values (optional)
+        :type max_bytes: int
+        :return: the number of removed values
+        :rtype: int
+        """
+        entries = []
+        for key in set(self['__keys__']):
+            meta = self._get_meta(key)
+            if meta is None:  # Set by an older version
+                meta = (None, 0, len(self._window.getProperty('{0}__{1}'.format(self._id, key))))
+            entries.append((meta[1], meta[2], key))
+        count = len(entries)
+        size = sum(entry[1] for entry in entries)
+
+        def over():
+            return (max_entries is not None and count > max_entries or
+                    max_bytes is not None and size > max_bytes)
+
+        evicted = 0
+        for accessed, length, key in sorted(entries):
+            if not over():
+                break
+            try:
+                del self[key]
+            except KeyError:
+                pass
+            count -= 1
+            size -= length
+            evicted += 1
+        return evicted
+
 
 class Addon(object):
     """
@@ -646,13 +938,47 @@ class Addon(object):
             storage_id = '{0}_{1}'.format(self.id, storage_id)
         return MemStorage(storage_id, window_id)
 
-    def _get_cached_data(self, cache, func, duration, *args, **kwargs):
+    @staticmethod
+    def _get_cache_key(func, args, kwargs, namespace=None):
+        """
+        Get a cache key for a function call
+
+        The key is an MD5 hash of the function name, the normalized arguments
+        and an optional namespace (e.g. a version that invalidates older entries).
+        ``self`` of a method is represented by its class, so calls on different
+        instances of the same class share cache entries.
+
+        :param func: cached function
+        :param args: function args
+        :type args: tuple
+        :param kwargs: function kwargs
+        :type kwargs: dict
+        :param namespace: cache namespace (optional)
+        :type namespace: str
+        :return: cache key
+        :rtype: str
+        """
+        if args and inspect.getargspec(func).args[:1] == ['self']:
+            cls = args[0].__class__
+            args = ({'self': '{0}.{1}'.format(cls.__module__, cls.__name__)},) + args[1:]
+        call = (namespace, func.__module__, func.__name__,
+                _normalize_cache_arg(args), _normalize_cache_arg(kwargs))
+        return md5(repr(call)).hexdigest()
+
+    def _get_cached_data(self, cache, func, duration, namespace, *args, **kwargs):
         """
         Get data from a cache object
 
+        Cached data is stored with its expiry time. The cache is swept every
+        ``CACHE_SWEEP_INTERVAL`` seconds, or earlier if entries added since the
+        last sweep take it over ``CACHE_MAX_ENTRIES`` entries: expired entries are
+        purged and the least recently used entries are evicted until the cache is
+        within ``CACHE_EVICT_RATIO`` of ``CACHE_MAX_ENTRIES`` entries and ``CACHE_MAX_BYTES`` bytes.
+
         :param cache: cache object
         :param func: function to cache
         :param duration: cache duration
+        :param namespace: cache namespace
         :param args: function args
         :param kwargs: function kwargs
         :return: function return data
@@ -660,20 +986,88 @@ class Addon(object):
         if duration <= 0:
             raise ValueError('Caching duration cannot be zero or negative!')
         current_time = time.time()
-        key = func.__name__ + str(args) + str(kwargs)
+        key = self._get_cache_key(func, args, kwargs, namespace)
+        stats = self._get_cache_stats(cache)
         try:
             data, timestamp = cache[key]
             # Invalidate old cached object with datetime timestamp
             if not isinstance(timestamp, float) or current_time - timestamp > duration * 60:
                 raise KeyError
-            self.log_debug('Cache hit: {0}'.format(key))
+            self.log_debug('Cache hit: {0} ({1})'.format(func.__name__, key))
+            stats['hits'] += 1
+            cache.touch(key)
         except KeyError:
-            self.log_debug('Cache miss: {0}'.format(key))
+            self.log_debug('Cache miss: {0} ({1})'.format(func.__name__, key))
+            stats['misses'] += 1
+            stats['added'] += 1
             data = func(*args, **kwargs)
-            cache[key] = (data, current_time)
+            cache.set(key, (data, current_time), expires=current_time + duration * 60)
+        if (current_time - stats['swept'] > CACHE_SWEEP_INTERVAL or
+                stats['entries'] + stats['added'] > CACHE_MAX_ENTRIES):
+            cache[CACHE_STATS_KEY] = stats  # Counted as an entry by the sweep
+            self._sweep_cache(cache, stats, current_time)
+        cache[CACHE_STATS_KEY] = stats
         return data
 
-    def cached(self, duration=10):
+    @staticmethod
+    def _get_cache_stats(cache):
+        """
+        Get cache statistics record
+
+        The record is kept in the cache object, so it is shared by all plugin calls.
+        Counters are approximate, as concurrent calls may overwrite each other's updates.
+
+        :param cache: cache object
+        :return: hit, miss and eviction counters, the time of the last sweep,
+            the number of entries after it and the number of entries added since
+        :rtype: dict
+        """
+        try:
+            return cache[CACHE_STATS_KEY]
+        except KeyError:
+            return {'hits': 0, 'misses': 0, 'evictions': 0, 'swept': 0.0, 'entries': 0, 'added': 0}
+
+    def _sweep_cache(self, cache, stats, current_time):
+        """
+        Purge expired cache entries and evict least recently used entries over the bounds
+
+        :param cache: cache object
+        :param stats: cache statistics record
+        :type stats: dict
+        :param current_time: current Unix time
+        :type current_time: float
+        """
+        purged = cache.purge_expired()
+        # The statistics record (most recently used) counts as an entry
+        evicted = cache.evict(int(CACHE_MAX_ENTRIES * CACHE_EVICT_RATIO) + 1,
+                              int(CACHE_MAX_BYTES * CACHE_EVICT_RATIO))
+        stats['evictions'] += evicted
+        stats.update(swept=current_time, entries=max(len(cache) - 1, 0), added=0)
+        self.log_debug('Cache sweep removed {0} expired and {1} least recently used entries'.format(
+            purged, evicted))
+
+    def get_cache_stats(self, mem_cache=False):
+        """
+        Get cache statistics
+
+        :param mem_cache: get statistics of :meth:`mem_cached` cache instead of :meth:`cached`
+        :type mem_cache: bool
+        :return: hits, misses, evictions and entries (approximate, see :meth:`_get_cache_stats`)
+        :rtype: dict
+        """
+        if mem_cache:
+            stats = self._get_cache_stats(self.get_mem_storage('***cache***'))
+        else:
+            with self.get_storage('__cache__.pcl') as cache:
+                stats = self._get_cache_stats(cache)
+        return {
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'evictions': stats['evictions'],
+            'entries': stats['entries'] + stats['added'],
+        }
+
+    def cached(self, duration=10, namespace=None):
         """
         Cached decorator
 
@@ -688,17 +1082,20 @@ class Addon(object):
 
         :param duration: caching duration in min (positive values only)
         :type duration: int
+        :param namespace: cache namespace, e.g. a version to invalidate entries
+            cached by older code (optional)
+        :type namespace: str
         :raises ValueError: if duration is zero or negative
         """
         def outer_wrapper(func):
             @wraps(func)
             def inner_wrapper(*args, **kwargs):
                 with self.get_storage('__cache__.pcl') as cache:
-                    return self._get_cached_data(cache, func, duration, *args, **kwargs)
+                    return self._get_cached_data(cache, func, duration, namespace, *args, **kwargs)
             return inner_wrapper
         return outer_wrapper
 
-    def mem_cached(self, duration=10):
+    def mem_cached(self, duration=10, namespace=None):
         """
         In-memory cache decorator
 
@@ -711,13 +1108,16 @@ class Addon(object):
 
         :param duration: caching duration in min (positive values only)
         :type duration: int
+        :param namespace: cache namespace, e.g. a version to invalidate entries
+            cached by older code (optional)
+        :type namespace: str
         :raises ValueError: if duration is zero or negative
         """
         def outer_wrapper(func):
             @wraps(func)
             def inner_wrapper(*args, **kwargs):
                 cache = self.get_mem_storage('***cache***')
-                return self._get_cached_data(cache, func, duration, *args, **kwargs)
+                return self._get_cached_data(cache, func, duration, namespace, *args, **kwargs)
             return inner_wrapper
         return outer_wrapper
 
@@ -788,8 +1188,7 @@ class Addon(object):
             raw_strings_hash = md5(raw_strings).hexdigest()
             gettext_pcl = '__gettext__.pcl'
             with self.get_storage(gettext_pcl) as ui_strings_map:
-                if (not os.path.exists(os.path.join(self._configdir, gettext_pcl)) or
-                        raw_strings_hash != ui_strings_map['hash']):
+                if 'hash' not in ui_strings_map or raw_strings_hash != ui_strings_map['hash']:
                     ui_strings = self._parse_po(raw_strings.split('\n'))
                     self._ui_strings_map = {
                         'hash': raw_strings_hash,
@@ -798,7 +1197,7 @@ class Addon(object):
                     ui_strings_map['hash'] = raw_strings_hash
                     ui_strings_map['strings'] = ui_strings.copy()
                 else:
-                    self._ui_strings_map = deepcopy(ui_strings_map)
+                    self._ui_strings_map = ui_strings_map.copy()
         else:
             raise SimplePluginError('Unable to initialize localization because of missing English strings.po!')
         return self.gettext
@@ -1161,16 +1560,19 @@ class Plugin(Addon):
         return PlayContext(path, play_item, succeeded)
 
     @staticmethod
-    def create_list_item(item):
+    def create_list_item(item, major_version=None):
         """
         Create an :class:`xbmcgui.ListItem` instance from an item dict
 
         :param item: a dict of ListItem properties
         :type item: dict
+        :param major_version: Kodi major version, e.g. ``'17'`` (optional, read from Kodi if omitted)
+        :type major_version: str
         :return: ListItem instance
         :rtype: xbmcgui.ListItem
         """
-        major_version = xbmc.getInfoLabel('System.BuildVersion')[:2]
+        if major_version is None:
+            major_version = get_kodi_major_version()
         if major_version >= '18':
             list_item = xbmcgui.ListItem(label=item.get('label', ''),
                                          label2=item.get('label2', ''),
@@ -1236,16 +1638,25 @@ class Plugin(Addon):
             xbmcplugin.setPluginCategory(self._handle, context.category)
         if context.content is not None:
             xbmcplugin.setContent(self._handle, context.content)  # This must be at the beginning
+        # Items are added in one call if the listing size is known, in chunks otherwise
+        total_items = len(context.listing) if isinstance(context.listing, (list, tuple)) else 0
+        major_version = get_kodi_major_version()
+        directory_items = []
         for item in context.listing:
             is_folder = item.get('is_folder', True)
             if item.get('list_item') is not None:
                 list_item = item['list_item']
             else:
-                list_item = self.create_list_item(item)
+                list_item = self.create_list_item(item, major_version)
                 if item.get('is_playable'):
                     list_item.setProperty('IsPlayable', 'true')
                     is_folder = False
-            xbmcplugin.addDirectoryItem(self._handle, item['url'], list_item, is_folder)
+            directory_items.append((item['url'], list_item, is_folder))
+            if not total_items and len(directory_items) >= LISTING_CHUNK_SIZE:
+                xbmcplugin.addDirectoryItems(self._handle, directory_items, total_items)
+                directory_items = []
+        if directory_items:
+            xbmcplugin.addDirectoryItems(self._handle, directory_items, total_items)
         if context.sort_methods is not None:
             if isinstance(context.sort_methods, (int, dict)):
                 sort_methods = [context.sort_methods]
@@ -6,18 +6,37 @@ import string
 import xbmc
 import xbmcgui
 import xbmcaddon
-from urllib import quote
 
-from lib.dplay import Dplay
-from lib.dplay_plugin import DplayPlugin
+from lib.dplay_plugin import DplayPlugin, variant_limits
 
 
 # Plugin
 plugin = DplayPlugin()
 
 
-# Dplay 
-dplay = Dplay()
+# Dplay (created on first API call, token and user are kept in memory
+# storage between invocations)
+class LazyDplay(object):
+    # Init
+    def __init__(self):
+        self._client = None
+
+    # Create client and proxy attribute access
+    def __getattr__(self, name):
+        if self._client is None:
+            from lib.dplay import Dplay
+            self._client = Dplay(
+                storage=plugin.get_mem_storage('dplay'),
+                cache=plugin.get_mem_storage('dplay_responses') if plugin.get_setting('cache_responses') else None,
+            )
+        return getattr(self._client, name)
+
+
+dplay = LazyDplay()
+
+# Background prefetches, finished before the plugin exits
+PREFETCH_TIMEOUT = 10 # Seconds
+prefetches = []
 
 
 # Action: Root
@@ -81,6 +100,12 @@ def root():
             'context_menu': context_menu,
             'url': plugin.get_url(action='channels', api_params={}),
         },
+        {
+            'label': 'Nedlastninger',
+            'thumb': plugin.get_resource('icon_video.png'),
+            'context_menu': context_menu,
+            'url': plugin.get_url(action='downloads'),
+        },
     ]
 
 
@@ -90,7 +115,8 @@ def shows_by_letter(params):
     return [{
         'label': letter,
         'url': plugin.get_url(action='shows', api_params={
-            'filter': {'name.startsWith': letter}
+            'filter': {'name.startsWith': letter},
+            'all_pages': True,
         }),
     } for letter in [l for l in string.ascii_uppercase] + ['Æ', 'Ø', 'Å', '#']]
 
@@ -100,10 +126,13 @@ def shows_by_letter(params):
 def shows(params):
     ''' Display list of shows '''
 
-    # Get shows
-    shows = dplay.shows(**params.api_params)
+    # Get shows (streamed page by page)
+    shows = dplay.iter_shows(**params.api_params)
 
-    items = [{
+    # Filter
+    hide_unavailable = plugin.get_setting('hide_unavailable_shows')
+
+    return ({
         'label': '%s [COLOR grey](%d)[/COLOR]' % (
             show.name if show.authorized else '[COLOR grey]%s[/COLOR]' % (show.name),
             show.video_count,
@@ -114,20 +143,21 @@ def shows(params):
             'video': {
                 'plot': show.description,
                 'genre': ', '.join([g.name for g in show.genres if 'produksjon' not in g.name]),
-                'aired': str(show.newest_episode_publish_start),
+                'aired': show.newest_episode_publish_start.strftime('%Y-%m-%d') if show.newest_episode_publish_start else '',
                 'mpaa': ', '.join([p[0:1].upper() for p in show.packages])
             }
         },
         'is_authorized': show.authorized,
         'is_folder': True,
+        'context_menu': [
+            ('Download show', 'XBMC.RunPlugin(%s)' % (
+                plugin.get_url(action='download_all', api_params={
+                    'filter': {'show.id': show.id},
+                })
+            ))
+        ] if show.authorized else [],
         'url': plugin.get_url(action='show', api_params={'show_id': show.id}),
-    } for show in shows]
-
-    # Filter
-    if plugin.get_setting('hide_unavailable_shows'):
-        items = [i for i in items if i.get('is_authorized', True)]
-
-    return items
+    } for show in shows if show.authorized or not hide_unavailable)
 
 
 # Action: Show
@@ -148,11 +178,22 @@ def show(params):
         ),
         'thumb': show.get_image_src('poster') or show.get_image_src('default'),
         'fanart': show.get_image_src('default'),
+        'context_menu': [
+            ('Download season', 'XBMC.RunPlugin(%s)' % (
+                plugin.get_url(action='download_all', api_params={
+                    'filter': {
+                        'show.id': show.id,
+                        'seasonNumber': season.season_number
+                    },
+                })
+            ))
+        ] if show.authorized else [],
         'url': plugin.get_url(action='videos', api_params={
             'filter': {
                 'show.id': show.id, 
                 'seasonNumber': season.season_number
-            }
+            },
+            'all_pages': True,
         }),
     } for season in sorted(show.seasons, key=lambda s: s.season_number, reverse=plugin.get_setting('reverse_sort'))]
 
@@ -162,10 +203,23 @@ def show(params):
 def videos(params):
     ''' Display list of videos '''
 
-    # Get videos
-    videos = dplay.videos(**params.api_params)
+    # Sort by episode number through the API unless another order is requested,
+    # so items can be streamed page by page
+    api_params = dict(params.api_params)
+
+    if not api_params.get('sort'):
+        api_params['sort'] = ['-episodeNumber' if plugin.get_setting('reverse_sort') else 'episodeNumber']
+
+    # Get videos (streamed page by page)
+    videos = dplay.iter_videos(**api_params)
+
+    if plugin.get_setting('prefetch_playables'):
+        videos = prefetch(videos, int(plugin.get_setting('prefetch_playables')))
+
+    # Filter
+    hide_unavailable = plugin.get_setting('hide_unavailable_videos')
 
-    items = [{        
+    return ({        
         # 'label': '[COLOR %s]%s%s[/COLOR]' % (
         'label': '[COLOR %s]%s[/COLOR]' % (
             'white' if video.authorized else 'grey',
@@ -178,7 +232,7 @@ def videos(params):
             'video': {
                 'plot': video.description,
                 'genre': ', '.join([g.name for g in video.genres if 'produksjon' not in g.name]),
-                'aired': str(video.aired),
+                'aired': video.aired.strftime('%Y-%m-%d') if video.aired else '',
                 'duration': video.duration,
                 'mpaa': ', '.join([p[0:1].upper() for p in video.packages])
             }
@@ -198,13 +252,24 @@ def videos(params):
             ))
         ] if video.authorized else [],
         'url': plugin.get_url(action='play', api_params={'video_id': video.id}),
-    } for video in sorted(videos, key=lambda v: v.episode_number, reverse=plugin.get_setting('reverse_sort'))]
+    } for video in videos if video.authorized or not hide_unavailable)
 
-    # Filter
-    if plugin.get_setting('hide_unavailable_videos'):
-        items = [i for i in items if i.get('is_authorized', True)]
 
-    return items
+# Prefetch playback details for the first authorized videos (while listing)
+def prefetch(videos, count):
+    video_ids = []
+
+    for video in videos:
+        if video.authorized and len(video_ids) < count:
+            video_ids.append(video.id)
+
+            if len(video_ids) == count:
+                prefetches.append(dplay.prefetch_playables(video_ids))
+
+        yield video
+
+    if 0 < len(video_ids) < count:
+        prefetches.append(dplay.prefetch_playables(video_ids))
 
 
 # Action: Play
@@ -222,18 +287,43 @@ def play(params):
     streams = playable.streams
 
     if 'hls' in streams and streams['hls']:
-        return streams['hls']
+        return select_stream(streams['hls'])
 
     xbmcgui.Dialog().notification('Avspillingsfeil', 'Ingen URL tilgjengelig')
 
 
+# Check download path (opens settings if not defined)
+def check_download_path():
+    if not plugin.get_setting('download_path'):
+        xbmcgui.Dialog().notification('Dplay Download', 'Nedlastningsmappe ikke definert')
+        xbmcaddon.Addon(id=plugin.id).openSettings()
+        return False
+
+    return True
+
+
+# Select stream variant (master playlist unless limited in settings)
+def select_stream(url):
+    limits = variant_limits(plugin)
+
+    if not limits:
+        return url
+
+    from lib import hls
+
+    try:
+        return hls.resolve_variant(url, **limits)
+
+    except Exception as e:
+        plugin.log_error('Variant selection failed (%s)' % (str(e)))
+        return url
+
+
 # Action: Download
 @plugin.action()
 def download(params):
     # Check settings
-    if not plugin.get_setting('download_path'):
-        xbmcgui.Dialog().notification('Dplay Download', 'Nedlastningsmappe ikke definert')
-        xbmcaddon.Addon(id=plugin.id).openSettings()
+    if not check_download_path():
         return None
 
     # Get video playback details
@@ -247,16 +337,162 @@ def download(params):
     
     if not stream:
         xbmcgui.Dialog().notification('Dplay Download', 'No stream available')
+        return None
 
-    # Execute download script
-    xbmc.executebuiltin('XBMC.RunScript(%s,%s,%s,%s,%s,%s)' % (
-        'special://home/addons/%s/lib/dplay_download.py' % (plugin.id),
-        quote(stream),
+    # Add to download queue (downloaded by the service)
+    from lib.dplay_queue import DownloadQueue
+
+    queued = DownloadQueue(plugin).add(
         params.video_id,
         params.video_full_name,
         params.duration,
-        plugin.get_setting('download_path')
-    ))
+        stream_url=stream,
+    )
+
+    xbmcgui.Dialog().notification('Dplay Download', 'Lagt i nedlastningskø' if queued else 'Allerede i nedlastningskø')
+
+
+# Action: Download all (season or show)
+@plugin.action()
+def download_all(params):
+    # Check settings
+    if not check_download_path():
+        return None
+
+    # Get authorized videos (all pages, in episode order)
+    videos = dplay.videos(all_pages=True, **params.api_params)
+
+    if videos is None:
+        xbmcgui.Dialog().notification('Dplay Download', 'Kunne ikke hente episoder')
+        return None
+
+    videos = sorted(
+        [v for v in videos if v.authorized],
+        key=lambda v: (v.season_number, v.episode_number)
+    )
+
+    if not videos:
+        xbmcgui.Dialog().notification('Dplay Download', 'Ingen tilgjengelige episoder')
+        return None
+
+    # Resolve playback details (concurrently)
+    playables = dplay.playables([v.id for v in videos])
+
+    jobs = [{
+        'video_id': video.id,
+        'video_full_name': video.full_name,
+        'duration': video.duration_ms,
+        'stream_url': playable.streams.get('hls'),
+    } for video, playable in zip(videos, playables) if playable and playable.streams.get('hls')]
+
+    # Add to download queue (downloaded by the service)
+    from lib.dplay_queue import DownloadQueue
+
+    queued = DownloadQueue(plugin).add_all(jobs)
+
+    xbmcgui.Dialog().notification('Dplay Download', '%d av %d episoder lagt i nedlastningskø' % (queued, len(videos)))
+
+
+# Action: Downloads
+@plugin.action()
+def downloads(params):
+    ''' Display download queue '''
+
+    from lib.dplay_queue import DownloadQueue, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+
+    def action(label, action, job, **kwargs):
+        return (label, 'XBMC.RunPlugin(%s)' % (
+            plugin.get_url(action=action, video_id=job['video_id'], **kwargs)
+        ))
+
+    def context_menu(job):
+        items = []
+
+        if job['state'] == QUEUED:
+            items.append(action('Download next', 'prioritize_download', job, position='first'))
+            items.append(action('Download last', 'prioritize_download', job, position='last'))
+
+        if job['state'] in (QUEUED, RUNNING):
+            items.append(action('Cancel download', 'cancel_download', job))
+
+        if job['state'] in (FAILED, CANCELLED):
+            items.append(action('Retry download', 'retry_download', job))
+
+        if job['state'] != RUNNING:
+            items.append(action('Remove from queue', 'remove_download', job))
+
+        return items
+
+    def item(job):
+        item = {
+            'label': '%s [COLOR grey](%s%s)[/COLOR]' % (
+                job['video_full_name'],
+                job['state'],
+                ', %s' % (job['error']) if job.get('error') else '',
+            ),
+            'context_menu': context_menu(job),
+        }
+
+        # Done downloads are played, other items refresh the list
+        if job['state'] == DONE and job.get('destination'):
+            item.update({'is_playable': True, 'url': job['destination']})
+        else:
+            item.update({'is_folder': True, 'url': plugin.get_url(action='downloads', refresh='true')})
+
+        return item
+
+    return plugin.create_listing(
+        [item(job) for job in DownloadQueue(plugin).jobs()],
+        update_listing=params.get('refresh') == 'true',
+    )
+
+
+# Action: Cancel download
+@plugin.action()
+def cancel_download(params):
+    from lib.dplay_queue import DownloadQueue
+
+    if DownloadQueue(plugin).cancel(params.video_id):
+        xbmcgui.Dialog().notification('Dplay Download', 'Nedlastning avbrytes')
+
+    xbmc.executebuiltin('Container.Refresh')
+
+
+# Action: Retry download
+@plugin.action()
+def retry_download(params):
+    from lib.dplay_queue import DownloadQueue
+
+    if DownloadQueue(plugin).retry(params.video_id):
+        xbmcgui.Dialog().notification('Dplay Download', 'Lagt i nedlastningskø')
+
+    xbmc.executebuiltin('Container.Refresh')
+
+
+# Action: Remove download (from queue, downloaded file is kept)
+@plugin.action()
+def remove_download(params):
+    from lib.dplay_queue import DownloadQueue
+
+    DownloadQueue(plugin).remove(params.video_id)
+
+    xbmc.executebuiltin('Container.Refresh')
+
+
+# Action: Prioritize download (first or last of queued downloads)
+@plugin.action()
+def prioritize_download(params):
+    from lib.dplay_queue import DownloadQueue
+
+    queue = DownloadQueue(plugin)
+    priorities = [j['priority'] for j in queue.jobs() if j['video_id'] != params.video_id]
+
+    if params.position == 'first':
+        queue.set_priority(params.video_id, max(priorities + [0]) + 1)
+    else:
+        queue.set_priority(params.video_id, min(priorities + [0]) - 1)
+
+    xbmc.executebuiltin('Container.Refresh')
 
 
 # Action: Channels
@@ -294,4 +530,9 @@ def channels(params):
 
 # Main
 if __name__ == '__main__':
-    plugin.run()  # Start plugin
\ No newline at end of file
+    plugin.run()  # Start plugin
+
+    # Finish prefetching (the listing is already shown)
+    for thread in prefetches:
+        if thread:
+            thread.join(PREFETCH_TIMEOUT)
\ No newline at end of file
@@ -0,0 +1,11 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Imports
+from lib.simpleplugin import Addon
+from lib.dplay_queue import DownloadScheduler
+
+
+# Main
+if __name__ == '__main__':
+    DownloadScheduler(Addon('plugin.video.dplayno')).run()  # Run queued downloads